@@ -1,15 +1,24 @@
 import os
+import threading
 from flask import Flask, session
 from authlib.integrations.flask_client import OAuth
 from dotenv import load_dotenv
 
 from services.DatabaseService import db
+import page_cache
+import request_context
 
 load_dotenv()
 
 app = Flask(__name__)
 app.secret_key = os.getenv("FLASK_SECRET_KEY")
 
+# Per-request identity map and query counting for the db layer
+request_context.init_app(app)
+
+# Cached card/header/comment fragments and ETags for full pages
+page_cache.init_app(app)
+
 # OAuth
 oauth = OAuth(app)
 google = oauth.register(
@@ -31,3 +40,7 @@ RECAPTCHA_SECRET = os.getenv("RECAPTCHA_SECRET_KEY")
 RECAPTCHA_SITE = os.getenv("RECAPTCHA_SITE_KEY")
 
 from routes import *
+from services.RecommendationService import RecommendationService
+
+# Warm the recommendation cache for the default location in the background
+threading.Thread(target=RecommendationService.prewarm, daemon=True).start()
@@ -1,6 +1,10 @@
+import os
 from flask import session, abort
 from services.DatabaseService import db
 
+# Users allowed to see operational endpoints such as /stats/cache (comma-separated UUIDs)
+ADMIN_USER_UUIDS = {uuid.strip() for uuid in os.getenv("ADMIN_USER_UUIDS", "").split(",") if uuid.strip()}
+
 def get_current_user():
     if "user_id" in session:
         return db.get_user_by_id(session["user_id"])
@@ -11,3 +15,9 @@ def require_business_user():
     if not user or user["role"] != "business":
         return abort(403)
     return user
+
+def require_admin():
+    user = get_current_user()
+    if not user or user["uuid"] not in ADMIN_USER_UUIDS:
+        return abort(403)
+    return user
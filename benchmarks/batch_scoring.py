@@ -0,0 +1,98 @@
+"""
+Micro-benchmarks for RecommendationService.score_batch, which re-ranks
+cached result pages for each visitor.
+
+Compares, for growing candidate sets:
+- scalar: a per-business loop (haversine_km + _score)
+- python: score_batch pure-Python fallback
+- numpy:  score_batch vectorized path (skipped if NumPy is missing)
+
+Each path is timed with and without search relevance / personal boosts.
+Runs without MongoDB.
+
+Usage:
+    python -m benchmarks.batch_scoring [--sizes 12,100,1000,10000,100000]
+"""
+import argparse
+import random
+import statistics
+import time
+
+from services.CacheService import haversine_km
+from services.RecommendationService import RecommendationService, np
+
+USER_LAT, USER_LNG = 43.892958, -79.228599
+
+
+def columns(size: int) -> dict:
+    return {
+        "lats": [USER_LAT + random.uniform(-0.45, 0.45) for _ in range(size)],
+        "lngs": [USER_LNG + random.uniform(-0.6, 0.6) for _ in range(size)],
+        "popularity": [random.uniform(0, 15) for _ in range(size)],
+        "relevance": [random.uniform(0, 2) for _ in range(size)],
+        "personal": [random.choice([0, 0, 0, random.uniform(0, 1.5)]) for _ in range(size)],
+    }
+
+
+def scalar_loop(cols: dict, with_boosts: bool):
+    scores = []
+
+    for i in range(len(cols["popularity"])):
+        distance_km = haversine_km(USER_LAT, USER_LNG, cols["lats"][i], cols["lngs"][i])
+
+        if with_boosts:
+            scores.append(RecommendationService._score(cols["popularity"][i], distance_km, cols["relevance"][i], cols["personal"][i]))
+        else:
+            scores.append(RecommendationService._score(cols["popularity"][i], distance_km))
+
+    return scores
+
+
+def batch(cols: dict, with_boosts: bool, vectorized: bool):
+    return RecommendationService.score_batch(
+        USER_LAT, USER_LNG,
+        cols["lats"], cols["lngs"], cols["popularity"],
+        relevance=cols["relevance"] if with_boosts else None,
+        personal=cols["personal"] if with_boosts else None,
+        vectorized=vectorized
+    )
+
+
+def median_ms(fn, runs: int) -> float:
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        fn()
+        timings.append((time.perf_counter() - start) * 1000)
+    return statistics.median(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", default="12,100,1000,10000,100000")
+    parser.add_argument("--runs", type=int, default=15)
+    args = parser.parse_args()
+
+    paths = [
+        ("scalar", lambda cols, b: scalar_loop(cols, b)),
+        ("python", lambda cols, b: batch(cols, b, vectorized=False)),
+    ]
+
+    if np is not None:
+        paths.append(("numpy", lambda cols, b: batch(cols, b, vectorized=True)))
+    else:
+        print("NumPy not installed; skipping vectorized path\n")
+
+    print(f"{'size':>8} {'terms':<10} " + " ".join(f"{name + ' ms':>12}" for name, _ in paths))
+
+    for size in (int(s) for s in args.sizes.split(",")):
+        cols = columns(size)
+
+        for with_boosts in (False, True):
+            timings = [median_ms(lambda: fn(cols, with_boosts), args.runs) for _, fn in paths]
+            label = "all" if with_boosts else "base"
+            print(f"{size:>8} {label:<10} " + " ".join(f"{t:>12.3f}" for t in timings))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,122 @@
+"""
+Measure the cost of shipping whole business_profiles documents to the
+index page versus compact BusinessCard results.
+
+Runs without MongoDB: builds synthetic "popular" businesses with many
+embedded comments, then compares
+- BSON payload size (what the driver moves over the wire)
+- Python memory held by one page of results (tracemalloc)
+- decode + card template render latency
+
+Usage:
+    python -m benchmarks.business_cards [--comments 5000] [--page-size 12]
+"""
+import argparse
+import statistics
+import time
+import tracemalloc
+import uuid
+from datetime import datetime, timezone
+
+import bson
+from jinja2 import Template
+
+from services.DatabaseService import BusinessCard, CARD_DESCRIPTION_CHARS
+
+CARD_TEMPLATE = Template("""
+{% for business in businesses %}
+<a href="/businesses/{{ business.uuid }}"><article class="business-card">
+    <img src="{{ business.image_url }}" alt="{{ business.name }} image">
+    <span class="badge muted">{{ business.category }}</span> {{ business.bookmarks }}
+    <h3 class="business-name">{{ business.name }}</h3>
+    <p class="business-desc">{{ business.description | truncate(120) }}</p>
+    {{ "%.1f"|format(business.rating) }} | {{ business.distance_km }} km
+</article></a>
+{% endfor %}
+""")
+
+
+def full_document(comment_count: int) -> dict:
+    now = datetime.now(timezone.utc)
+
+    return {
+        "uuid": str(uuid.uuid4()),
+        "name": "Popular Business",
+        "category": "Food",
+        "address": "96 Cornell Park Ave",
+        "city": "Markham",
+        "province": "ON",
+        "description": "A neighbourhood favourite " * 20,
+        "image_url": "https://example.com/image.png",
+        "location": {"type": "Point", "coordinates": [-79.22, 43.89]},
+        "combined_rating": 4200,
+        "users_rated": 1000,
+        "bookmarks": 350,
+        "rating": 4.2,
+        "distance_km": 1.25,
+        "distance_m": 1250.0,
+        "score": 12.3,
+        "coupons": {str(uuid.uuid4()): {"name": "Deal", "code": "SAVE", "description": "x" * 200, "discount": 0.1, "expiry": now} for _ in range(50)},
+        "comments": {
+            str(uuid.uuid4()): {"author_uuid": str(uuid.uuid4()), "comment": "Great place! " * 40, "likes": 3, "liked_by": [str(uuid.uuid4()) for _ in range(3)], "created": now}
+            for _ in range(comment_count)
+        },
+    }
+
+
+def card_document(doc: dict) -> dict:
+    projected = {field: doc[field] for field in ("uuid", "name", "category", "image_url", "bookmarks", "rating", "distance_km", "distance_m", "score")}
+    projected["description"] = doc["description"][:CARD_DESCRIPTION_CHARS]
+    return projected
+
+
+def held_memory(build) -> int:
+    tracemalloc.start()
+    page = build()
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del page
+    return size
+
+
+def latency_ms(fn, runs: int = 20) -> float:
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        fn()
+        timings.append((time.perf_counter() - start) * 1000)
+    return statistics.median(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--comments", type=int, default=5000)
+    parser.add_argument("--page-size", type=int, default=12)
+    args = parser.parse_args()
+
+    docs = [full_document(args.comments) for _ in range(args.page_size)]
+    full_payloads = [bson.encode(d) for d in docs]
+    card_payloads = [bson.encode(card_document(d)) for d in docs]
+
+    def decode_full():
+        return [bson.decode(p) for p in full_payloads]
+
+    def decode_cards():
+        return [BusinessCard.from_doc(bson.decode(p)) for p in card_payloads]
+
+    rows = [
+        ("before (full documents)", full_payloads, decode_full, lambda: CARD_TEMPLATE.render(businesses=decode_full())),
+        ("after (business cards)", card_payloads, decode_cards, lambda: CARD_TEMPLATE.render(businesses=decode_cards())),
+    ]
+
+    print(f"page of {args.page_size} businesses, {args.comments} comments each\n")
+    print(f"{'':<26} {'wire KB':>10} {'held KB':>10} {'decode ms':>10} {'render ms':>10}")
+
+    for label, payloads, decode, render in rows:
+        wire_kb = sum(len(p) for p in payloads) / 1024
+        held_kb = held_memory(decode) / 1024
+        print(f"{label:<26} {wire_kb:>10.1f} {held_kb:>10.1f} {latency_ms(decode):>10.2f} {latency_ms(render):>10.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,155 @@
+"""
+Compare the legacy recommendation path (paginate first, then rate, filter
+and sort the page in Python) with the pushed-down pipeline built by
+RecommendationService._pipeline.
+
+Seeds 100k businesses around the default location into a separate
+`db_benchmark` database so production data is never touched.
+
+Usage:
+    python -m benchmarks.recommend_pushdown [--businesses 100000] [--runs 20]
+"""
+import argparse
+import math
+import random
+import statistics
+import time
+import uuid
+
+from services.CacheService import haversine_km
+from services.DatabaseService import client, rating_fields
+from services.RecommendationService import RecommendationService
+
+CENTER_LAT, CENTER_LNG = 43.892958, -79.228599
+CATEGORIES = ["Food", "Service", "Shop", "Health"]
+
+
+def seed(collection, count: int):
+    """
+    Drop and re-seed the benchmark collection with `count` random businesses
+    spread over roughly 50km around the default location.
+    """
+    collection.drop()
+
+    batch = []
+    for i in range(count):
+        users_rated = random.randint(0, 50)
+        combined_rating = sum(random.randint(1, 5) for _ in range(users_rated))
+        bookmarks = random.randint(0, 200)
+
+        batch.append({
+            "uuid": str(uuid.uuid4()),
+            "name": f"Business {i}",
+            "category": random.choice(CATEGORIES),
+            "description": "Seeded benchmark business",
+            "location": {
+                "type": "Point",
+                "coordinates": [CENTER_LNG + random.uniform(-0.6, 0.6), CENTER_LAT + random.uniform(-0.45, 0.45)]
+            },
+            "combined_rating": combined_rating,
+            "users_rated": users_rated,
+            "bookmarks": bookmarks,
+            "comments": {},
+            "coupons": {},
+            **rating_fields(combined_rating, users_rated, bookmarks)
+        })
+
+        if len(batch) == 5000:
+            collection.insert_many(batch)
+            batch = []
+
+    if batch:
+        collection.insert_many(batch)
+
+    collection.create_index([("location", "2dsphere"), ("category", 1), ("avg_rating", 1), ("search_tokens", 1)])
+
+
+def legacy_score(business: dict, rating: float, distance_km: float) -> float:
+    """
+    The previous per-business score: (rating * 2) + log(bookmarks + 1) - (distance_km * 0.2).
+    """
+    bookmarks = int(business.get("bookmarks", 0))
+    return (rating * 2) + math.log(bookmarks + 1) - (distance_km * 0.2)
+
+
+def legacy_recommend(collection, lat, lng, max_distance_km, min_rating, limit, offset):
+    """
+    The previous implementation: $skip/$limit on raw $geoNear output,
+    then rating, minimum rating filter and score in Python.
+    """
+    pipeline = [
+        {"$geoNear": {"near": {"type": "Point", "coordinates": [lng, lat]}, "distanceField": "distance_m", "maxDistance": int(max_distance_km * 1000), "spherical": True}},
+        {"$facet": {"results": [{"$skip": offset}, {"$limit": limit}], "totalCount": [{"$count": "count"}]}}
+    ]
+
+    data = list(collection.aggregate(pipeline))[0]
+    results = []
+
+    for b in data["results"]:
+        users_rated = int(b.get("users_rated", 0))
+        rating = float(b.get("combined_rating", 0)) / users_rated if users_rated > 0 else 0
+
+        if rating < min_rating:
+            continue
+
+        distance_km = haversine_km(lat, lng, b["location"]["coordinates"][1], b["location"]["coordinates"][0])
+
+        b["rating"] = round(rating, 1)
+        b["distance_km"] = round(distance_km, 2)
+        b["score"] = legacy_score(b, rating, distance_km)
+        results.append(b)
+
+    results.sort(key=lambda x: x["score"], reverse=True)
+    return results
+
+
+def pushdown_recommend(collection, lat, lng, max_distance_km, min_rating, limit, offset):
+    """
+    The current implementation: ranking stages run before pagination.
+    """
+    pipeline = RecommendationService._pipeline(lat, lng, max_distance_km, min_rating, None, None)
+    pipeline.append({"$facet": {"results": [{"$skip": offset}, {"$limit": limit}], "totalCount": [{"$count": "count"}]}})
+    return list(collection.aggregate(pipeline))[0]["results"]
+
+
+def measure(fn, runs: int):
+    timings = []
+    returned = 0
+
+    for _ in range(runs):
+        start = time.perf_counter()
+        returned = len(fn())
+        timings.append((time.perf_counter() - start) * 1000)
+
+    return statistics.median(timings), max(timings), returned
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--businesses", type=int, default=100_000)
+    parser.add_argument("--runs", type=int, default=20)
+    parser.add_argument("--skip-seed", action="store_true")
+    args = parser.parse_args()
+
+    collection = client["db_benchmark"]["business_profiles"]
+
+    if not args.skip_seed:
+        print(f"Seeding {args.businesses} businesses...")
+        seed(collection, args.businesses)
+
+    scenarios = [
+        ("10 km, page 1", 10, 0, 12, 0),
+        ("10 km, page 5, rating >= 4", 10, 4, 12, 48),
+        ("anywhere, page 1", 20020, 0, 12, 0),
+    ]
+
+    print(f"{'scenario':<30} {'path':<10} {'median ms':>10} {'max ms':>10} {'rows':>6}")
+
+    for name, distance, rating, limit, offset in scenarios:
+        for label, fn in (("legacy", legacy_recommend), ("pushdown", pushdown_recommend)):
+            median, worst, rows = measure(lambda: fn(collection, CENTER_LAT, CENTER_LNG, distance, rating, limit, offset), args.runs)
+            print(f"{name:<30} {label:<10} {median:>10.1f} {worst:>10.1f} {rows:>6}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,14 @@
+import sys
+from services.PersonalizationService import PersonalizationService
+
+# Build personalized feeds for users whose activity changed since the last run.
+# Schedule periodically (e.g. cron). Pass --all once to backfill every user,
+# or --rebuild to reset co-occurrence counts and recompute everything.
+if __name__ == "__main__":
+    if "--rebuild" in sys.argv:
+        PersonalizationService.rebuild()
+    elif "--all" in sys.argv:
+        PersonalizationService.mark_all_dirty()
+
+    stats = PersonalizationService.build_feeds()
+    print("Processed users:", stats["users"], "| pair updates:", stats["pair_updates"])
@@ -1,8 +1,9 @@
 import uuid
 import random
 import re
-from services.DatabaseService import business_profiles
+from services.DatabaseService import business_profiles, rating_fields, BUSINESS_SCHEMA_VERSION
 from services.GeocodingService import GeocodingService
+from services.SearchService import SearchService
 
 
 class BusinessService:
@@ -106,8 +107,14 @@ def build_business_object(parsed_data: dict):
         "combined_rating": combined_rating,
         "users_rated": users_rated,
         "bookmarks": bookmarks,
-        "comments": {},
-        "coupons": {}
+        "comment_count": 0,
+        # Seeded counts, not backed by user ratings (see db.reconcile_ratings)
+        "base_combined_rating": combined_rating,
+        "base_users_rated": users_rated,
+        "version": 1,
+        "schema_version": BUSINESS_SCHEMA_VERSION,
+        **SearchService.index_fields(parsed_data["business_name"], parsed_data["description"]),
+        **rating_fields(combined_rating, users_rated, bookmarks)
     }
 
 
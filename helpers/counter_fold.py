@@ -0,0 +1,9 @@
+from services.DatabaseService import db
+
+# Fold the bookmark counter shards of all businesses into their profiles
+# (bookmarks, popularity). App processes fold the businesses they touched
+# every COUNTER_FOLD_SECONDS; this picks up the rest (e.g. after a crash).
+# Safe to re-run and to run while the app is serving.
+if __name__ == "__main__":
+    folded = db.fold_counter_shards()
+    print("Folded businesses:", folded)
@@ -0,0 +1,19 @@
+import sys
+from services.MigrationService import MigrationService
+
+# Upgrade documents to the current schema versions while the app is serving.
+# Usage: python -m helpers.migrate [businesses users comments] [--batch N] [--pause SECONDS] [--restart]
+# Interrupt at any time; the next run resumes from the last finished batch.
+# --restart rescans from the beginning (e.g. after restoring old documents).
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    batch_size = int(args[args.index("--batch") + 1]) if "--batch" in args else 500
+    pause = float(args[args.index("--pause") + 1]) if "--pause" in args else 0.1
+    names = [arg for arg in args if arg in MigrationService.MIGRATIONS] or list(MigrationService.MIGRATIONS)
+
+    for name in names:
+        if "--restart" in args:
+            MigrationService.reset(name)
+
+        stats = MigrationService.run(name, batch_size=batch_size, pause_seconds=pause)
+        print(f"{name}: scanned {stats['scanned']} | upgraded {stats['upgraded']} | still pending {MigrationService.pending(name)}")
@@ -0,0 +1,7 @@
+from services.DatabaseService import db
+
+# Recompute stored avg_rating/popularity for all business profiles.
+# Run once after deploying materialized rating fields, or to repair drift.
+if __name__ == "__main__":
+    updated = db.backfill_rating_fields()
+    print("Updated businesses:", updated)
@@ -0,0 +1,9 @@
+from services.DatabaseService import db
+
+# Check combined_rating/users_rated of all business profiles against the users'
+# ratings plus each business's base offsets (seeded/legacy counts) and fix the
+# ones that drifted. The first run only records offsets for businesses that
+# have none. Safe to re-run and to run while the app is serving.
+if __name__ == "__main__":
+    updated = db.reconcile_ratings()
+    print("Updated businesses:", updated)
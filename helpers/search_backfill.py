@@ -0,0 +1,7 @@
+from services.DatabaseService import db
+
+# Rebuild search tokens for all business profiles.
+# Run once after deploying indexed search, and after tokenizer changes.
+if __name__ == "__main__":
+    updated = db.backfill_search_tokens()
+    print("Updated businesses:", updated)
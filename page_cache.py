@@ -0,0 +1,140 @@
+import hashlib
+import os
+from flask import current_app, make_response, request, session
+from markupsafe import Markup
+from services.CacheService import TTLCache
+
+# Rendered HTML fragments. Keys include the business `version`, so writes
+# never need to invalidate anything here; stale entries simply stop being hit.
+FRAGMENT_TTL_SECONDS = 600
+fragment_cache = TTLCache(maxsize=4096, ttl=FRAGMENT_TTL_SECONDS)
+
+# Hash of every template, mixed into each key/ETag so a deploy that changes
+# markup never serves fragments or 304s rendered by the old templates
+_template_digest = ""
+
+def init_app(app):
+    """
+    Register the fragment helpers as Jinja globals and fingerprint the templates.
+    """
+    global _template_digest
+
+    digest = hashlib.sha1()
+    folder = os.path.join(app.root_path, app.template_folder)
+
+    for root, _, files in sorted(os.walk(folder)):
+        for name in sorted(files):
+            with open(os.path.join(root, name), "rb") as f:
+                digest.update(name.encode())
+                digest.update(f.read())
+
+    _template_digest = digest.hexdigest()[:12]
+
+    app.jinja_env.globals.update(render_card=render_card, render_business_header=render_business_header, render_comments=render_comments)
+
+def cached_fragment(key: tuple, template: str, **context) -> Markup:
+    """
+    Return the rendered template for key, rendering it on a miss.
+
+    Fragment templates only see the context passed here (no context
+    processors), so everything they show must be part of the key.
+    """
+    key = (_template_digest, template) + key
+    html = fragment_cache.get(key)
+
+    if html is None:
+        html = current_app.jinja_env.get_template(template).render(**context)
+        fragment_cache.set(key, html)
+
+    return Markup(html)
+
+def render_card(business, variant: str = "explore") -> Markup:
+    """
+    Business card for the explore grid, sponsored slot and sidebars.
+
+    Parameters:
+    - business (BusinessCard): Card with a `version`.
+    - variant (str): "explore", "sponsored", "bookmark" or "recent".
+    """
+    # Distance differs per visitor, so only the explore card depends on it
+    distance = business.distance_km if variant == "explore" else None
+
+    return cached_fragment((business.uuid, business.version, variant, distance), "business_card.html", business=business, variant=variant)
+
+def card_state(cards) -> list:
+    """
+    What a list of rendered cards depends on, for page ETags.
+    """
+    return [(card.uuid, card.version, card.distance_km) for card in cards]
+
+def user_state(user: dict):
+    """
+    The part of the current user shown on every page (navbar).
+    """
+    if not user:
+        return None
+
+    return (user["uuid"], user["type"], user.get("name"), user.get("picture"))
+
+def viewer_state(business: dict, user: dict):
+    """
+    The part of the current user that changes how a business page looks.
+    """
+    if not user:
+        return None
+
+    if user["type"] != "standard":
+        return (user["type"],)
+
+    return (user["type"], business["uuid"] in (user.get("bookmarks") or []))
+
+def render_business_header(business: dict, user: dict) -> Markup:
+    """
+    Image, name, badges, description and contact details of a business page.
+    """
+    state = viewer_state(business, user)
+
+    return cached_fragment((business["uuid"], business.get("version"), state), "business_header.html", business=business, viewer=state)
+
+def render_comments(business: dict, comments: list) -> Markup:
+    """
+    Comment cards for one page of reviews. Keyed on the processed comments
+    themselves: they already reflect author changes and the viewer's likes.
+    """
+    digest = hashlib.sha1(repr([sorted(c.items()) for c in comments]).encode()).hexdigest()
+
+    return cached_fragment((business["uuid"], business.get("version"), digest), "business_comments_list.html", comments=comments)
+
+def conditional_render(etag_parts, render):
+    """
+    Serve a page with a strong ETag, answering 304 Not Modified when the
+    client already has it, in which case render() is never called.
+
+    Parameters:
+    - etag_parts: Everything the page depends on (repr-able).
+    - render (callable): Returns the page body.
+
+    Returns:
+    - flask Response
+    """
+    # Flashed messages are shown once; never hide them behind a 304
+    if session.get("_flashes"):
+        response = make_response(render())
+        response.headers["Cache-Control"] = "private, no-cache"
+        return response
+
+    etag = hashlib.sha1(repr((_template_digest, etag_parts)).encode()).hexdigest()
+
+    if request.if_none_match.contains(etag):
+        response = make_response("", 304)
+    else:
+        response = make_response(render())
+
+    response.set_etag(etag)
+
+    # The page depends on the session (user, location): browser cache only,
+    # always revalidated
+    response.headers["Cache-Control"] = "private, no-cache"
+    response.vary.add("Cookie")
+
+    return response
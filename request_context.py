@@ -0,0 +1,44 @@
+from flask import g, request
+from services.DatabaseService import BusinessCardLoader, start_request_scope, end_request_scope, current_request_scope
+
+def init_app(app):
+    """
+    Give every request its own RequestScope (identity map + query counter).
+
+    The query count is logged at debug level and, when app.debug or the
+    DB_QUERY_HEADERS config flag is set, returned in the X-DB-Queries and
+    X-DB-Identity-Hits response headers.
+    """
+
+    @app.before_request
+    def open_request_scope():
+        g.request_scope_token = start_request_scope()
+
+    @app.after_request
+    def report_request_scope(response):
+        scope = current_request_scope()
+
+        if scope is not None:
+            app.logger.debug("%s %s: %d db queries, %d identity map hits", request.method, request.path, scope.queries, scope.hits)
+
+            if app.debug or app.config.get("DB_QUERY_HEADERS"):
+                response.headers["X-DB-Queries"] = str(scope.queries)
+                response.headers["X-DB-Identity-Hits"] = str(scope.hits)
+
+        return response
+
+    @app.teardown_request
+    def close_request_scope(exc):
+        token = g.pop("request_scope_token", None)
+
+        if token is not None:
+            end_request_scope(token)
+
+def business_loader() -> BusinessCardLoader:
+    """
+    Return the business card loader for the current request.
+    Every deferred lookup in a request is coalesced into one query.
+    """
+    if "business_loader" not in g:
+        g.business_loader = BusinessCardLoader()
+    return g.business_loader
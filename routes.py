@@ -4,14 +4,21 @@ import uuid
 from datetime import datetime, timezone
 from flask import abort, redirect, url_for, session, request, render_template, flash, jsonify
 from app import app, RECAPTCHA_SITE, RECAPTCHA_SECRET, google
-from auth_utils import get_current_user, require_business_user
+from auth_utils import get_current_user, require_business_user, require_admin
+from page_cache import fragment_cache, conditional_render, card_state, user_state, viewer_state
+from request_context import business_loader
 from services.DatabaseService import db
-from services.GeocodingService import GeocodingService
+from services.GeocodingService import GeocodingService, GeocodingBusyError
 from services.ImageStorageService import ImageStorageService
+from services.ParallelLoader import ParallelLoader
 from services.RecommendationService import RecommendationService
 
 ISS = ImageStorageService()
 
+# Per-branch time budgets for the home page's concurrent data loading
+RECOMMEND_TIMEOUT_SECONDS = 3
+SIDEBAR_TIMEOUT_SECONDS = 1
+
 @app.route("/")
 def index():
     user = get_current_user()
@@ -23,13 +30,14 @@ def index():
     per_page = 12
     offset = (page - 1) * per_page
 
+    cursor = request.args.get("cursor") or None
     query = request.args.get("query") or None
     category = request.args.get("category") or None
     max_distance = request.args.get("distance", type=int) or 10
     min_rating = request.args.get("rating", type=int) or 0
 
     if not user_lat or not user_lng:
-        user_lat, user_lng = 43.892958, -79.228599
+        user_lat, user_lng = RecommendationService.DEFAULT_LAT, RecommendationService.DEFAULT_LNG
 
     if category and category != "none" and category != "all":
         categories = [category]
@@ -43,34 +51,55 @@ def index():
     if max_distance >= 20:
         max_distance = 20020
 
-    sponsor = RecommendationService.recommend_sponsored_business(user_lat=user_lat, user_lng=user_lng)
+    # An in-memory grid lookup (queries only on refresh); it decides the page
+    # size, so it is resolved before the concurrent branches
+    sponsored_business = RecommendationService.recommend_sponsored_business(user_lat=user_lat, user_lng=user_lng)
 
-    if sponsor:
-        sponsored_business = db.get_business_info(sponsor["uuid"])
+    if sponsored_business:
         per_page = 11
         offset = (page - 1) * per_page
-    else:
-        sponsored_business = None
 
-    businesses, total = RecommendationService.recommend(user_lat=user_lat, user_lng=user_lng, user_query=query, max_distance_km=max_distance, min_rating=min_rating, categories=categories, limit=per_page, offset=offset)
+    # "20+ km" covers the whole collection; don't count past the ceiling
+    estimate_count = max_distance >= 20020
 
-    total_pages = math.ceil(total / per_page)
+    def load_recommendations():
+        return RecommendationService.recommend(user_lat=user_lat, user_lng=user_lng, user_query=query, max_distance_km=max_distance, min_rating=min_rating, categories=categories, limit=per_page, offset=offset, estimate_count=estimate_count, cursor=cursor, user_uuid=user["uuid"] if user else None)
 
-    if user:
-        bookmarked_businesses = [
-            db.get_business_info(b) for b in user["bookmarks"]
-        ]
-    else:
-        bookmarked_businesses = None
+    branches = {"recommendations": (load_recommendations, RECOMMEND_TIMEOUT_SECONDS, ([], 0))}
 
+    # Both sidebars resolve together in one batched query
     if user:
-        recent_businesses = [
-            db.get_business_info(b) for b in user["recently_viewed"]
-        ]
-    else:
-        recent_businesses = None
+        loader = business_loader()
+        bookmarks, recents = loader.defer(user["bookmarks"]), loader.defer(user["recently_viewed"])
+        branches["sidebars"] = (lambda: (bookmarks.resolve(), recents.resolve()), SIDEBAR_TIMEOUT_SECONDS, (None, None))
+
+    # Independent queries run concurrently; a failed or slow branch falls back
+    # to an empty section instead of failing the page
+    loaded = ParallelLoader.gather(branches)
 
-    return render_template("index.html", businesses=businesses, sponsored_business=sponsored_business, address=user_location, bookmarks=bookmarked_businesses, recently_viewed=recent_businesses, page=page, total_pages=total_pages)
+    businesses, total = loaded["recommendations"]
+    bookmarked_businesses, recent_businesses = loaded.get("sidebars", (None, None))
+
+    next_cursor = RecommendationService.next_cursor(businesses) if len(businesses) == per_page else None
+
+    total_pages = math.ceil(total / per_page)
+    total_label = str(total)
+
+    if estimate_count and total > RecommendationService.COUNT_CEILING:
+        total_label = f"{RecommendationService.COUNT_CEILING}+"
+
+        # The real count is unknown past the ceiling; keep "Next" while pages are full
+        if len(businesses) == per_page:
+            total_pages = max(total_pages, page + 1)
+
+    etag_parts = (
+        sorted(request.args.items(multi=True)), user_location, user_state(user),
+        card_state(businesses), card_state([sponsored_business] if sponsored_business else []),
+        card_state(bookmarked_businesses or []), card_state(recent_businesses or []),
+        total_pages, total_label, next_cursor
+    )
+
+    return conditional_render(etag_parts, lambda: render_template("index.html", businesses=businesses, sponsored_business=sponsored_business, address=user_location, bookmarks=bookmarked_businesses, recently_viewed=recent_businesses, page=page, total_pages=total_pages, total_label=total_label, next_cursor=next_cursor))
 
 @app.route("/businesses/<string:business_uuid>")
 def businesses(business_uuid):
@@ -85,54 +114,44 @@ def businesses(business_uuid):
     page = request.args.get("page", 1, type=int)
     per_page = 10
     sort = request.args.get("sort", "newest")
+    cursor = request.args.get("cursor") or None
 
     processed_comments = []
-    total_pages = 0
-
-    if business and business.get("comments"):
-        comments = list(business["comments"].items())
-
-        total_pages = math.ceil(len(comments) / per_page)
-
-        if sort == "most_helpful":
-            comments.sort(key=lambda x: (-x[1]["likes"], -x[1]["created"].timestamp()))
-        else:
-            comments.sort(key=lambda x: x[1]["created"], reverse=True)
-
-        start = (page - 1) * per_page
-        end = start + per_page
-
-        for comment_uuid, comment in comments[start:end]:
-            author = db.get_user_by_uuid(comment["author_uuid"])
-            if not author:
-                continue
-
-            processed_comments.append({
-                "uuid": comment_uuid,
-                "author_name": author["name"],
-                "author_picture": author["picture"],
-                "comment": comment["comment"],
-                "likes": int(comment["likes"]),
-                "liked": user and user["uuid"] in comment.get("liked_by", []),
-                "created": comment["created"]
-            })
-
-    now = datetime.now(timezone.utc)
-    active_coupons = {}
-
-    for key, coupon in business["coupons"].items():
-        expiry = coupon["expiry"]
-
-        expiry_ts = (expiry.replace(tzinfo=timezone.utc).timestamp() if expiry.tzinfo is None else expiry.timestamp())
-
-        now_ts = now.timestamp()
-
-        if expiry_ts >= now_ts:
-            active_coupons[key] = coupon
-
-    business["coupons"] = active_coupons
-
-    return render_template("businesses.html", business=business, now=datetime.now(timezone.utc), uuid=business_uuid, comments=processed_comments, current_user=user, page=page, total_pages=total_pages)
+    total_pages = math.ceil(business.get("comment_count", 0) / per_page)
+
+    page_comments = db.get_business_comments(business_uuid, page=page, per_page=per_page, sort=sort, cursor=cursor)
+    next_cursor = db.comment_cursor(page_comments, sort) if len(page_comments) == per_page else None
+
+    # All authors on the page in at most one query
+    authors = db.get_comment_authors([comment["author_uuid"] for comment in page_comments])
+    liked = db.get_liked_comments(user["uuid"], [comment["uuid"] for comment in page_comments]) if user else set()
+
+    for comment in page_comments:
+        author = authors.get(comment["author_uuid"])
+        if not author:
+            continue
+
+        processed_comments.append({
+            "uuid": comment["uuid"],
+            "author_name": author["name"],
+            "author_picture": author["picture"],
+            "comment": comment["comment"],
+            "likes": int(comment["likes"]),
+            "liked": comment["uuid"] in liked,
+            "created": comment["created"]
+        })
+
+    # Only active coupons are read (indexed expiry range)
+    active_coupons = db.get_business_coupons(business_uuid)
+    business = {**business, "coupons": active_coupons}
+
+    etag_parts = (
+        business_uuid, business.get("version"), sorted(request.args.items(multi=True)),
+        user_state(user), viewer_state(business, user), (user.get("rated") or {}).get(business_uuid) if user else None,
+        [sorted(c.items()) for c in processed_comments], sorted(active_coupons), total_pages, next_cursor
+    )
+
+    return conditional_render(etag_parts, lambda: render_template("businesses.html", business=business, now=datetime.now(timezone.utc), uuid=business_uuid, comments=processed_comments, current_user=user, page=page, total_pages=total_pages, next_cursor=next_cursor))
 
 @app.route("/businesses/<string:business_uuid>/bookmark", methods=["POST"])
 def businesses_bookmark(business_uuid):
@@ -217,6 +236,12 @@ def like_comment(business_uuid, comment_uuid):
 
     return {"success": True, "data": result}, 200
 
+@app.route("/stats/cache")
+def cache_stats():
+    require_admin()
+
+    return jsonify({**RecommendationService.cache_stats(), "fragments": fragment_cache.stats(), "geocoding": GeocodingService.cache_stats(), "loader": ParallelLoader.stats()})
+
 @app.route("/login")
 def login():
     if get_current_user():
@@ -232,6 +257,9 @@ def set_location():
             city = request.form.get("city"),
             province = request.form.get("province")
         )
+    except GeocodingBusyError:
+        flash("Address lookups are busy right now. Please try again in a moment.", "danger")
+        return redirect("/")
     except Exception:
         flash("Address not found. Please check the address.", "danger")
         return redirect("/")
@@ -329,6 +357,8 @@ def signup_redirect():
                     city = request.form.get("city"),
                     province = request.form.get("province")
                 )
+            except GeocodingBusyError:
+                return render_template("signup_redirect.html", error="Address lookups are busy right now. Please try again in a moment.")
             except Exception:
                 return render_template("signup_redirect.html", error="We couldn't locate your address. Please check and try again.")
 
@@ -355,8 +385,7 @@ def signup_redirect():
                 "combined_rating": 0,
                 "users_rated": 0,
                 "bookmarks": 0,
-                "comments": {},
-                "coupons": {}
+                "comment_count": 0
             }
 
             required_fields = [business["name"], business["address"], business["city"], business["province"], business["postal_code"], business["description"], business["phone"]]
@@ -403,6 +432,10 @@ def dashboard():
         return render_template("dashboard.html", user=user)
     elif user["type"] == "business":
         business_profile = db.get_business_info(user["uuid"])
+
+        if business_profile:
+            business_profile = {**business_profile, "coupons": db.get_business_coupons(user["uuid"], active_only=False)}
+
         return render_template("dashboard.html", user=user, business=business_profile, now=datetime.now())
     else:
         flash("Something went wrong.", "danger")
@@ -580,6 +613,9 @@ def modify_business():
         else:
             lng, lat = business["location"]["coordinates"]
 
+    except GeocodingBusyError:
+        flash("Address lookups are busy right now. Please try again in a moment.", "danger")
+        return redirect("/dashboard")
     except Exception:
         flash("We couldn't locate your address. Please check and try again.", "danger")
         return redirect("/dashboard")
@@ -0,0 +1,275 @@
+import math
+import threading
+import time
+from collections import OrderedDict
+
+class TTLCache:
+    """
+    Small thread-safe in-process cache with a size bound (LRU eviction)
+    and a per-entry time-to-live.
+
+    Keeps hit/miss/eviction counters so caches can be sized from real traffic.
+    """
+
+    _MISSING = object()
+
+    def __init__(self, maxsize: int = 1024, ttl: float = 60):
+        """
+        Parameters:
+        - maxsize (int): Maximum number of entries before LRU eviction.
+        - ttl (float): Seconds an entry stays valid after being set.
+        """
+        self.maxsize = maxsize
+        self.ttl = ttl
+
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, key, default=None):
+        """
+        Return the cached value for key, or default if missing/expired.
+        """
+        with self._lock:
+            entry = self._data.get(key, self._MISSING)
+
+            if entry is self._MISSING:
+                self.misses += 1
+                return default
+
+            value, expires_at = entry
+
+            if expires_at <= time.monotonic():
+                del self._data[key]
+                self.expirations += 1
+                self.misses += 1
+                return default
+
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value, ttl: float = None):
+        """
+        Store value under key, evicting the least recently used entry if full.
+        """
+        expires_at = time.monotonic() + (self.ttl if ttl is None else ttl)
+
+        with self._lock:
+            self._data[key] = (value, expires_at)
+            self._data.move_to_end(key)
+
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, key):
+        """
+        Remove a single key (no-op if missing).
+        """
+        with self._lock:
+            self._data.pop(key, None)
+
+    def invalidate_where(self, predicate) -> int:
+        """
+        Remove every entry whose key matches predicate(key).
+        Returns the number of removed entries.
+
+        The predicate runs on a snapshot of the keys, outside the lock, so
+        readers are only blocked for the copy and the deletes.
+        """
+        with self._lock:
+            keys = list(self._data)
+
+        stale = [key for key in keys if predicate(key)]
+
+        with self._lock:
+            for key in stale:
+                self._data.pop(key, None)
+
+        return len(stale)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self) -> dict:
+        """
+        Return counters and current size.
+        """
+        with self._lock:
+            lookups = self.hits + self.misses
+
+            return {
+                "size": len(self._data),
+                "maxsize": self.maxsize,
+                "ttl": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+                "evictions": self.evictions,
+                "expirations": self.expirations
+            }
+
+
+class _Call:
+    __slots__ = ("done", "result", "error")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+class SingleFlight:
+    """
+    Coalesces concurrent calls for the same key: the first caller runs the
+    function, callers arriving while it runs wait for it and share its
+    result (or exception). Nothing is kept after the call returns.
+    """
+
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+
+        self.calls = 0
+        self.shared = 0
+
+    def do(self, key, fn):
+        """
+        Return fn(), or the result of the identical call already in flight.
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+
+            if leader:
+                call = self._calls[key] = _Call()
+                self.calls += 1
+            else:
+                self.shared += 1
+
+        if not leader:
+            call.done.wait()
+
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn()
+        except Exception as error:
+            call.error = error
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+        return call.result
+
+
+_GEOHASH_ALPHABET = "0123456789bcdefghjkmnpqrstuvwxyz"
+
+def geohash(lat: float, lng: float, precision: int = 5) -> str:
+    """
+    Encode coordinates as a geohash cell id.
+
+    Approximate cell sizes:
+    - 4: ~39km x 20km
+    - 5: ~4.9km x 4.9km
+    - 6: ~1.2km x 0.6km
+    """
+    lat_range = [-90.0, 90.0]
+    lng_range = [-180.0, 180.0]
+
+    cell = []
+    bits = 0
+    bit_count = 0
+    even = True
+
+    while len(cell) < precision:
+        rng, value = (lng_range, lng) if even else (lat_range, lat)
+        mid = (rng[0] + rng[1]) / 2
+
+        if value >= mid:
+            bits = (bits << 1) | 1
+            rng[0] = mid
+        else:
+            bits = bits << 1
+            rng[1] = mid
+
+        even = not even
+        bit_count += 1
+
+        if bit_count == 5:
+            cell.append(_GEOHASH_ALPHABET[bits])
+            bits = 0
+            bit_count = 0
+
+    return "".join(cell)
+
+
+def geohash_bounds(cell: str):
+    """
+    Decode a geohash cell into its bounding box.
+
+    Returns:
+    - (lat_min, lat_max, lng_min, lng_max)
+    """
+    lat_range = [-90.0, 90.0]
+    lng_range = [-180.0, 180.0]
+    even = True
+
+    for char in cell:
+        bits = _GEOHASH_ALPHABET.index(char)
+
+        for shift in range(4, -1, -1):
+            rng = lng_range if even else lat_range
+            mid = (rng[0] + rng[1]) / 2
+
+            if (bits >> shift) & 1:
+                rng[0] = mid
+            else:
+                rng[1] = mid
+
+            even = not even
+
+    return lat_range[0], lat_range[1], lng_range[0], lng_range[1]
+
+def geohash_center(cell: str):
+    """
+    Return the (lat, lng) center of a geohash cell.
+    """
+    lat_min, lat_max, lng_min, lng_max = geohash_bounds(cell)
+    return (lat_min + lat_max) / 2, (lng_min + lng_max) / 2
+
+def haversine_km(lat1, lng1, lat2, lng2) -> float:
+    """
+    Great-circle distance in kilometers between two coordinates.
+    """
+    dlat = math.radians(lat2 - lat1)
+    dlng = math.radians(lng2 - lng1)
+
+    a = (
+        math.sin(dlat / 2) ** 2 +
+        math.cos(math.radians(lat1)) *
+        math.cos(math.radians(lat2)) *
+        math.sin(dlng / 2) ** 2
+    )
+
+    return 6371 * 2 * math.atan2(math.sqrt(a), math.sqrt(1 - a))
+
+def cell_may_contain(cell: str, radius_km: float, lat: float, lng: float) -> bool:
+    """
+    True if a point is within radius_km of any location inside the cell.
+    Used to find cached searches that a changed business could appear in.
+    """
+    lat_min, lat_max, lng_min, lng_max = geohash_bounds(cell)
+    center_lat, center_lng = (lat_min + lat_max) / 2, (lng_min + lng_max) / 2
+    half_diagonal = haversine_km(center_lat, center_lng, lat_max, lng_max)
+
+    return haversine_km(center_lat, center_lng, lat, lng) <= radius_km + half_diagonal
@@ -1,23 +1,627 @@
-from pymongo import MongoClient, ReturnDocument
+import base64
+import hashlib
+import json
+import math
+from pymongo import MongoClient, ReturnDocument, UpdateOne, monitoring
 import os
+import random
+import re
+import unicodedata
 import uuid
 from better_profanity import profanity
 from bson.objectid import ObjectId
-from datetime import datetime, timezone
+from contextvars import ContextVar
+from datetime import datetime, timedelta, timezone
 from dotenv import load_dotenv
+from services.CacheService import TTLCache
+from services.RateLimiter import TokenBucket, MongoBucketStore
+from services.SearchService import SearchService
+from services.WriteBehind import WriteBehindBuffer
 
 load_dotenv()
 
-client = MongoClient(os.getenv("MONGO_URI"))
+class _QueryCounter(monitoring.CommandListener):
+    """
+    Counts MongoDB commands issued inside an active RequestScope.
+    """
+
+    def started(self, event):
+        scope = _request_scope.get()
+        if scope is not None:
+            scope.queries += 1
+
+    def succeeded(self, event):
+        pass
+
+    def failed(self, event):
+        pass
+
+client = MongoClient(os.getenv("MONGO_URI"), event_listeners=[_QueryCounter()])
 db_client = client["db"]
 users = db_client["users"]
 business_profiles = db_client["business_profiles"]
 sponsored_businesses = db_client["sponsored_businesses"]
+item_cooccurrence = db_client["item_cooccurrence"]
+user_feeds = db_client["user_feeds"]
+comments = db_client["comments"]
+rate_limits = db_client["rate_limits"]
+comment_likes = db_client["comment_likes"]
+coupons = db_client["coupons"]
+migrations = db_client["migrations"]
+geocode_cache = db_client["geocode_cache"]
+counter_shards = db_client["counter_shards"]
 
 users.create_index("auth.google", unique=True, sparse=True)
-business_profiles.create_index([("location", "2dsphere")])
+# Lookups by uuid, including batched comment author loads ($in)
+users.create_index("uuid", unique=True)
+# Users whose bookmarks/ratings/recents changed since the last feed build
+users.create_index("feed_dirty", sparse=True)
+item_cooccurrence.create_index([("a", 1), ("b", 1)], unique=True)
+item_cooccurrence.create_index([("a", 1), ("count", -1)])
+user_feeds.create_index("user_uuid", unique=True)
+# Comment pages: one index per sort order, plus duplicate lookups by normalized text
+comments.create_index("uuid", unique=True)
+comments.create_index([("business_uuid", 1), ("created", -1), ("uuid", -1)], name="business_newest")
+comments.create_index([("business_uuid", 1), ("likes", -1), ("created", -1), ("uuid", -1)], name="business_helpful")
+comments.create_index([("business_uuid", 1), ("author_uuid", 1), ("text_hash", 1)], name="business_author_text")
+# One document per (user, comment) ever liked; "which of these comments did this user like" is one index scan
+comment_likes.create_index([("user_uuid", 1), ("comment_uuid", 1)], unique=True)
+# Rate limiting no longer scans an author's comments
+# and most-helpful pages use business_helpful (uuid tie-breaker for cursors)
+for legacy_index in ("business_author", "business_most_helpful"):
+    if legacy_index in comments.index_information():
+        comments.drop_index(legacy_index)
+# Active coupons of a business come from an index range; MongoDB deletes each
+# coupon at `purge_at` (expiry + COUPON_RETENTION_DAYS, see db.create_coupon)
+coupons.create_index("uuid", unique=True)
+coupons.create_index([("business_uuid", 1), ("expiry", 1)])
+coupons.create_index("purge_at", expireAfterSeconds=0)
+# Shared token buckets (RATE_LIMIT_BACKEND=mongo); idle buckets expire after a day
+rate_limits.create_index("updated", expireAfterSeconds=86400)
+# Geocoding results (and "not found" answers) are deleted once `expires` passes
+geocode_cache.create_index("expires", expireAfterSeconds=0)
+# Bookmark counter shards of a business, summed on read and folded into its profile
+counter_shards.create_index("business_uuid")
+# Geo search index: $geoNear filters on category, minimum rating and search tokens use the same index.
+# $geoNear needs an unambiguous 2dsphere index, so earlier location indexes are dropped.
+business_profiles.create_index([("location", "2dsphere"), ("category", 1), ("avg_rating", 1), ("search_tokens", 1)], name="geo_rating_search")
+for legacy_index in ("location_2dsphere", "geo_search"):
+    if legacy_index in business_profiles.index_information():
+        business_profiles.drop_index(legacy_index)
+# Profile and card lookups (single and batched $in) by uuid
+business_profiles.create_index("uuid", unique=True)
 sponsored_businesses.create_index([("location", "2dsphere")])
 
+# Callbacks run after a write that can change how a business ranks or renders
+# (rating, bookmarks, location, card fields). Called as fn(business_uuid, coordinates),
+# where coordinates is [lng, lat] or None when the location is unknown.
+business_change_listeners = []
+
+def notify_business_change(business_uuid: str, coordinates=None):
+    """
+    Notify every registered listener that a business changed.
+    """
+    for listener in business_change_listeners:
+        listener(business_uuid, coordinates)
+
+def _coordinates(business):
+    """
+    Extract [lng, lat] from a (projected) business document, if present.
+    """
+    if not business or "location" not in business:
+        return None
+    return business["location"]["coordinates"]
+
+# Weight of the average rating in the ranking score (see RecommendationService._score)
+RATING_WEIGHT = 2
+
+# Stored ranking fields, recomputed in the same (atomic) update as their inputs:
+# - avg_rating: combined_rating / users_rated
+# - popularity: distance-independent part of the score, (avg_rating * 2) + ln(bookmarks + 1)
+RATING_FIELD_STAGES = [
+    {"$set": {"avg_rating": {"$cond": [
+        {"$gt": [{"$ifNull": ["$users_rated", 0]}, 0]},
+        {"$divide": [{"$ifNull": ["$combined_rating", 0]}, "$users_rated"]},
+        0
+    ]}}},
+    {"$set": {"popularity": {"$add": [
+        {"$multiply": ["$avg_rating", RATING_WEIGHT]},
+        {"$ln": {"$add": [{"$max": [{"$ifNull": ["$bookmarks", 0]}, 0]}, 1]}}
+    ]}}}
+]
+
+def rating_fields(combined_rating: float, users_rated: int, bookmarks: int) -> dict:
+    """
+    Python equivalent of RATING_FIELD_STAGES, for documents built before insert.
+    """
+    avg_rating = combined_rating / users_rated if users_rated > 0 else 0
+
+    return {
+        "avg_rating": avg_rating,
+        "popularity": (avg_rating * RATING_WEIGHT) + math.log(max(bookmarks, 0) + 1)
+    }
+
+def _counter_update(increments: dict) -> list:
+    """
+    Build an update pipeline that increments counters and refreshes the
+    stored ranking fields in one atomic document update. Counters never
+    go below 0. Also bumps the business version (see CARD_PROJECTION).
+    """
+    increments = {**increments, "version": 1}
+
+    return [{"$set": {field: {"$max": [0, {"$add": [{"$ifNull": [f"${field}", 0]}, delta]}]} for field, delta in increments.items()}}] + RATING_FIELD_STAGES
+
+# Counters changed by bookmarks and ratings
+COUNTER_FIELDS = ("bookmarks", "combined_rating", "users_rated")
+
+def _fold_counter_shards(business_uuids: list) -> int:
+    """
+    Move the bookmark counts of shard documents into their business profiles.
+    Each business is one transaction: the shards are reset by exactly the
+    amounts read and the profile (bookmarks, popularity, version) moves by
+    their sum, so concurrent shard writes are neither lost nor counted twice.
+    Shards of deleted businesses are dropped.
+
+    Returns the number of folded businesses.
+    """
+    folded = []
+
+    def fold(session, business_uuid):
+        shards = list(counter_shards.find({"business_uuid": business_uuid, "bookmarks": {"$ne": 0}}, {"bookmarks": 1}, session=session))
+
+        if not shards:
+            return None
+
+        counter_shards.bulk_write([UpdateOne({"_id": shard["_id"]}, {"$inc": {"bookmarks": -shard["bookmarks"]}}) for shard in shards], ordered=False, session=session)
+
+        business = business_profiles.find_one_and_update(
+            {"uuid": business_uuid},
+            _counter_update({"bookmarks": sum(shard["bookmarks"] for shard in shards)}),
+            projection={"location": 1, "_id": 0},
+            session=session
+        )
+
+        if not business:
+            counter_shards.delete_many({"business_uuid": business_uuid}, session=session)
+
+        return business
+
+    # Retried as a whole on transient errors (e.g. a shard write conflicting with the fold)
+    with client.start_session() as session:
+        for business_uuid in business_uuids:
+            business = session.with_transaction(lambda session: fold(session, business_uuid))
+
+            if business:
+                folded.append((business_uuid, business))
+
+    for business_uuid, business in folded:
+        _counter_read_cache.invalidate(business_uuid)
+        notify_business_change(business_uuid, _coordinates(business))
+
+    return len(folded)
+
+# Bookmark counters of hot businesses: each toggle increments one of
+# COUNTER_SHARDS shard documents (chosen at random) instead of the profile,
+# so concurrent toggles of one business do not queue on a single document.
+# Shard writes are durable; readers sum profile + shards. Businesses with
+# shard writes are folded into their profile (bookmarks, popularity) every
+# COUNTER_FOLD_SECONDS by this process; `python -m helpers.counter_fold`
+# folds everything left over (e.g. after a crash). COUNTER_SHARDS=0 writes
+# through to the profile.
+COUNTER_SHARDS = int(os.getenv("COUNTER_SHARDS", "8"))
+COUNTER_FOLD_SECONDS = float(os.getenv("COUNTER_FOLD_SECONDS", "5"))
+# Only "this business has shard writes" is buffered; losing it loses no counts
+counter_fold_buffer = WriteBehindBuffer(lambda pending: _fold_counter_shards(list(pending)), lambda older, newer: True, interval=COUNTER_FOLD_SECONDS)
+COUNTER_READ_TTL_SECONDS = 2
+_counter_read_cache = TTLCache(maxsize=10000, ttl=COUNTER_READ_TTL_SECONDS)
+
+def _business_counters(business_uuid: str):
+    """
+    Current bookmarks/combined_rating/users_rated of a business, with its
+    unfolded bookmark shards added (one query, cached for
+    COUNTER_READ_TTL_SECONDS). None if the business does not exist.
+    """
+    counters = _counter_read_cache.get(business_uuid)
+
+    if counters is None:
+        counters = next(business_profiles.aggregate([
+            {"$match": {"uuid": business_uuid}},
+            {"$project": {**dict.fromkeys(COUNTER_FIELDS, 1), "uuid": 1, "_id": 0}},
+            {"$lookup": {"from": "counter_shards", "localField": "uuid", "foreignField": "business_uuid", "as": "shards"}},
+            {"$project": {
+                "bookmarks": {"$add": [{"$ifNull": ["$bookmarks", 0]}, {"$sum": "$shards.bookmarks"}]},
+                **{field: {"$ifNull": [f"${field}", 0]} for field in COUNTER_FIELDS if field != "bookmarks"}
+            }}
+        ]), None)
+
+        if counters is None:
+            return None
+
+        _counter_read_cache.set(business_uuid, counters)
+
+    return counters
+
+def _apply_counter_deltas(business_uuid: str, deltas: dict):
+    """
+    Change a business's bookmark counter (on a random shard unless
+    COUNTER_SHARDS=0). The business must exist.
+    Returns the current counters, or None if the business does not exist.
+    """
+    if COUNTER_SHARDS > 0:
+        shard = random.randrange(COUNTER_SHARDS)
+
+        counter_shards.update_one(
+            {"_id": f"{business_uuid}:{shard}"},
+            {"$inc": deltas, "$set": {"business_uuid": business_uuid}},
+            upsert=True
+        )
+
+        counter_fold_buffer.add(business_uuid, True)
+
+        # This process's cached sum moves with its own writes; others catch up within the TTL
+        counters = _counter_read_cache.get(business_uuid)
+
+        if counters is not None:
+            counters = {field: counters.get(field, 0) + deltas.get(field, 0) for field in COUNTER_FIELDS}
+            _counter_read_cache.set(business_uuid, counters)
+            return counters
+
+        return _business_counters(business_uuid)
+
+    business = business_profiles.find_one_and_update(
+        {"uuid": business_uuid},
+        _counter_update(deltas),
+        projection={**dict.fromkeys(COUNTER_FIELDS, 1), "location": 1, "_id": 0},
+        return_document=ReturnDocument.AFTER
+    )
+
+    _counter_read_cache.invalidate(business_uuid)
+
+    if business:
+        notify_business_change(business_uuid, _coordinates(business))
+
+    return business
+
+# Fields needed to render a business card (explore grid, sidebars).
+# Description is cut server-side; cards only ever show the first 120 characters.
+# `version` is bumped by every db write to a business and keys rendered fragments.
+CARD_DESCRIPTION_CHARS = 160
+CARD_PROJECTION = {
+    "_id": 0,
+    "uuid": 1,
+    "name": 1,
+    "category": 1,
+    "image_url": 1,
+    "bookmarks": 1,
+    "version": 1,
+    "description": {"$substrCP": [{"$ifNull": ["$description", ""]}, 0, CARD_DESCRIPTION_CHARS]},
+}
+
+class BusinessCard:
+    """
+    Compact, slotted view of a business used wherever only a card is rendered.
+    Never carries comments or coupons, so its size does not grow with activity.
+    Supports both attribute (templates) and item (legacy dict code) access.
+    """
+
+    __slots__ = ("uuid", "name", "category", "description", "image_url", "bookmarks", "rating", "distance_km", "distance_m", "score", "version")
+
+    def __init__(self, uuid, name, category=None, description="", image_url=None, bookmarks=0, rating=0, distance_km=None, distance_m=None, score=None, version=None):
+        self.uuid = uuid
+        self.name = name
+        self.category = category
+        self.description = description
+        self.image_url = image_url
+        self.bookmarks = bookmarks
+        self.rating = rating
+        self.distance_km = distance_km
+        self.distance_m = distance_m
+        self.score = score
+        self.version = version
+
+    @classmethod
+    def from_doc(cls, doc: dict):
+        """
+        Build a card from a (projected) business_profiles document.
+        """
+        return cls(
+            uuid=doc["uuid"],
+            name=doc.get("name"),
+            category=doc.get("category"),
+            description=doc.get("description") or "",
+            image_url=doc.get("image_url"),
+            bookmarks=int(doc.get("bookmarks", 0)),
+            rating=doc.get("rating", 0),
+            distance_km=doc.get("distance_km"),
+            distance_m=doc.get("distance_m"),
+            score=doc.get("score"),
+            version=doc.get("version")
+        )
+
+    def __getitem__(self, key):
+        try:
+            return getattr(self, key)
+        except AttributeError:
+            raise KeyError(key)
+
+    def get(self, key, default=None):
+        return getattr(self, key, default)
+
+    def to_dict(self) -> dict:
+        """
+        Serialize the card (e.g. for JSON responses).
+        """
+        return {field: getattr(self, field) for field in self.__slots__}
+
+class RequestScope:
+    """
+    Per-request identity map and query counter.
+
+    While a scope is active (see start_request_scope), user and business
+    lookups through `db` hit the database at most once per document; the
+    `db` write methods forget the documents they change. Every command sent
+    to MongoDB during the scope is counted.
+    """
+
+    def __init__(self):
+        self._docs = {}
+        self.queries = 0
+        self.hits = 0
+
+    def lookup(self, key):
+        """
+        Return (True, doc) if key is cached (doc may be None), else (False, None).
+        """
+        if key in self._docs:
+            self.hits += 1
+            return True, self._docs[key]
+        return False, None
+
+    def remember(self, key, doc):
+        self._docs[key] = doc
+
+        # Users are looked up by ObjectId and by UUID; share one entry
+        if doc is not None and key[0] in ("user_id", "user_uuid"):
+            self._docs[("user_id", str(doc["_id"]))] = doc
+            self._docs[("user_uuid", doc.get("uuid"))] = doc
+
+    def forget_user(self, user_uuid: str = None, user_id: str = None):
+        doc = self._docs.pop(("user_uuid", user_uuid), None) if user_uuid else None
+        doc = self._docs.pop(("user_id", str(user_id)), None) if user_id else doc
+
+        if doc is not None:
+            self._docs.pop(("user_id", str(doc["_id"])), None)
+            self._docs.pop(("user_uuid", doc.get("uuid")), None)
+
+    def forget_business(self, business_uuid: str):
+        self._docs.pop(("business", business_uuid), None)
+
+_request_scope = ContextVar("request_scope", default=None)
+
+# One comment per 30 seconds for each user on each business. Buckets are
+# per process unless RATE_LIMIT_BACKEND=mongo shares them through MongoDB.
+COMMENT_BURST = 1
+COMMENT_REFILL_SECONDS = 30
+comment_limiter = TokenBucket(
+    COMMENT_BURST,
+    COMMENT_REFILL_SECONDS,
+    store=MongoBucketStore(rate_limits) if os.getenv("RATE_LIMIT_BACKEND") == "mongo" else None
+)
+
+def comment_text_hash(text: str) -> str:
+    """
+    Hash of a comment's normalized text (case, accents and whitespace
+    ignored), used to find duplicates with one indexed lookup.
+    Always given the censored text, the only form stored for old comments.
+    """
+    normalized = unicodedata.normalize("NFKC", text).casefold()
+    normalized = re.sub(r"\s+", " ", normalized).strip()
+
+    return hashlib.sha1(normalized.encode()).hexdigest()
+
+def _decode_comment_cursor(cursor: str, sort: str):
+    """
+    Decode a token from db.comment_cursor for the given sort.
+    Returns None for missing or malformed tokens (callers fall back to skip).
+    """
+    if not cursor:
+        return None
+
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        key = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        created, comment_uuid = datetime.fromisoformat(key[-2]), str(key[-1])
+
+        if sort == "most_helpful":
+            likes, = key[:-2]
+            return int(likes), created, comment_uuid
+
+        return created, comment_uuid
+    except (ValueError, TypeError, IndexError):
+        return None
+
+def _store_likes(pairs: list):
+    """
+    Record (comment_uuid, user_uuid) pairs as liked (migration of liked_by arrays).
+    Only inserts: a like or unlike already recorded through the toggle is newer.
+    """
+    if pairs:
+        comment_likes.bulk_write([
+            UpdateOne({"user_uuid": user_uuid, "comment_uuid": comment_uuid}, {"$setOnInsert": {"liked": True}}, upsert=True)
+            for comment_uuid, user_uuid in pairs
+        ], ordered=False)
+
+# Length of users.recently_viewed
+RECENT_LIMIT = 10
+
+def _recent_views_update(business_uuids: list) -> list:
+    """
+    Build an update pipeline that moves business_uuids (newest first) to
+    the front of recently_viewed, drops older duplicates and trims the list,
+    in one atomic update. feed_dirty is only touched when the list changes
+    beyond reordering the newest entry.
+    """
+    viewed = [{"$literal": business_uuid} for business_uuid in business_uuids]
+    current = {"$ifNull": ["$recently_viewed", []]}
+
+    return [{"$set": {
+        "recently_viewed": {"$slice": [
+            {"$concatArrays": [viewed, {"$filter": {"input": current, "cond": {"$not": [{"$in": ["$$this", viewed]}]}}}]},
+            RECENT_LIMIT
+        ]},
+        "feed_dirty": {"$cond": [
+            {"$eq": [{"$slice": [current, len(viewed)]}, viewed]},
+            "$feed_dirty",
+            "$$NOW"
+        ]}
+    }}]
+
+def _flush_recent_views(pending: dict):
+    """
+    Write buffered views: one pipeline update per user, in one bulk_write.
+    """
+    users.bulk_write([UpdateOne({"uuid": user_uuid}, _recent_views_update(viewed)) for user_uuid, viewed in pending.items()], ordered=False)
+
+def _merge_recent_views(older, newer):
+    """
+    Combine buffered views of one user (lists are newest first).
+    """
+    older = [business_uuid for business_uuid in (older or []) if business_uuid not in newer]
+    return (newer + older)[:RECENT_LIMIT]
+
+# Optional write-behind for recently viewed businesses: with
+# RECENT_VIEWS_WRITE_BEHIND=<seconds>, views are coalesced per user and
+# flushed in bulk at that interval (sidebars may lag by up to one interval).
+_recent_views_interval = os.getenv("RECENT_VIEWS_WRITE_BEHIND")
+recent_views_buffer = WriteBehindBuffer(_flush_recent_views, _merge_recent_views, interval=float(_recent_views_interval)) if _recent_views_interval else None
+
+# Document layout versions. Documents with a lower (or no) schema_version are
+# reshaped by MigrationService in throttled batches; until it reaches them,
+# the db read methods upgrade or adapt them on read (see upgrade_businesses).
+# Business version 2: all of the business's comments are at COMMENT_SCHEMA_VERSION.
+BUSINESS_SCHEMA_VERSION = 2
+USER_SCHEMA_VERSION = 1
+COMMENT_SCHEMA_VERSION = 2
+
+# Name and picture of comment authors, shared across requests. Invalidated by
+# the db methods that change them, but only in the process that made the
+# write: other processes can show an old name or picture for up to the TTL.
+AUTHOR_CACHE_SIZE = 10000
+AUTHOR_TTL_SECONDS = 300
+_author_cache = TTLCache(maxsize=AUTHOR_CACHE_SIZE, ttl=AUTHOR_TTL_SECONDS)
+
+def start_request_scope():
+    """
+    Open a RequestScope for the current context. Returns a token for end_request_scope.
+    """
+    return _request_scope.set(RequestScope())
+
+def end_request_scope(token):
+    """
+    Close the scope opened with token and return it (for reporting).
+    """
+    scope = _request_scope.get()
+    _request_scope.reset(token)
+    return scope
+
+def current_request_scope():
+    """
+    Return the active RequestScope, or None outside a request.
+    """
+    return _request_scope.get()
+
+def _cached(key, load):
+    scope = _request_scope.get()
+
+    if scope is None:
+        return load()
+
+    found, doc = scope.lookup(key)
+
+    if not found:
+        doc = load()
+        scope.remember(key, doc)
+
+    return doc
+
+def _forget_user(user_uuid: str = None, user_id: str = None):
+    scope = _request_scope.get()
+    if scope is not None:
+        scope.forget_user(user_uuid, user_id)
+
+def _forget_business(business_uuid: str):
+    scope = _request_scope.get()
+    if scope is not None:
+        scope.forget_business(business_uuid)
+
+class BusinessCardLoader:
+    """
+    Batches and caches business card lookups (DataLoader style).
+    Meant to live for a single request (see request_context.business_loader).
+
+    defer() only queues UUIDs; the first time any deferred result is used,
+    every queued UUID is fetched with a single db.get_business_cards call.
+    """
+
+    def __init__(self):
+        self._cards = {}
+        self._queue = []
+
+    def defer(self, uuids: list):
+        """
+        Queue UUIDs and return a lazy, iterable list of their cards.
+        """
+        uuids = list(uuids or [])
+
+        for u in uuids:
+            if u not in self._cards and u not in self._queue:
+                self._queue.append(u)
+
+        return DeferredCards(self, uuids)
+
+    def load_many(self, uuids: list) -> list:
+        """
+        Return cards for UUIDs (input order, missing dropped), fetching now.
+        """
+        return self.defer(uuids).resolve()
+
+    def _dispatch(self):
+        if not self._queue:
+            return
+
+        queue, self._queue = self._queue, []
+
+        for card in db.get_business_cards(queue):
+            self._cards[card.uuid] = card
+
+        # Remember misses so they are not fetched again
+        for u in queue:
+            self._cards.setdefault(u, None)
+
+class DeferredCards:
+    """
+    Lazy result of BusinessCardLoader.defer; resolves on first use.
+    """
+
+    __slots__ = ("_loader", "_uuids", "_cards")
+
+    def __init__(self, loader: BusinessCardLoader, uuids: list):
+        self._loader = loader
+        self._uuids = uuids
+        self._cards = None
+
+    def resolve(self) -> list:
+        if self._cards is None:
+            self._loader._dispatch()
+            self._cards = [self._loader._cards[u] for u in self._uuids if self._loader._cards.get(u)]
+        return self._cards
+
+    def __iter__(self):
+        return iter(self.resolve())
+
+    def __len__(self):
+        return len(self.resolve())
+
 class db:
     """
     Database abstraction layer for handling user and business operations.
@@ -36,49 +640,107 @@ class db:
         """
         Retrieve a user by MongoDB ObjectId.
         """
-        return users.find_one({"_id": ObjectId(user_id)})
+        return _cached(("user_id", str(user_id)), lambda: _user_compat(users.find_one({"_id": ObjectId(user_id)})))
     
     @staticmethod
     def get_user_by_uuid(uuid: str):
         """
         Retrieve a user by internal UUID.
         """
-        return users.find_one({"uuid": uuid})
+        return _cached(("user_uuid", uuid), lambda: _user_compat(users.find_one({"uuid": uuid})))
     
+    @staticmethod
+    def get_comment_authors(user_uuids: list) -> dict:
+        """
+        Resolve the display name and picture of many comment authors.
+        Cached authors are served from memory; the rest are fetched in one
+        projected query.
+
+        Returns:
+        - dict: user_uuid -> {"name", "picture"} (unknown users are left out)
+        """
+        authors = {}
+        missing = []
+
+        for user_uuid in dict.fromkeys(user_uuids):
+            author = _author_cache.get(user_uuid)
+
+            if author is None:
+                missing.append(user_uuid)
+            else:
+                authors[user_uuid] = author
+
+        if missing:
+            for user in users.find({"uuid": {"$in": missing}}, {"uuid": 1, "name": 1, "picture": 1, "_id": 0}):
+                author = {"name": user.get("name"), "picture": user.get("picture")}
+                _author_cache.set(user["uuid"], author)
+                authors[user["uuid"]] = author
+
+        return authors
+
     @staticmethod
     def get_business_info(uuid: str):
         """
         Retrieve business profile information by UUID.
+        Profiles in an older layout are upgraded first.
         """
-        return business_profiles.find_one({"uuid": uuid})
+        return _cached(("business", uuid), lambda: _load_business(uuid))
     
+    @staticmethod
+    def get_business_cards(uuids: list):
+        """
+        Retrieve business cards for many UUIDs in one query.
+        Preserves input order and drops UUIDs with no business.
+        """
+        if not uuids:
+            return []
+
+        found = {b["uuid"]: BusinessCard.from_doc(b) for b in business_profiles.find({"uuid": {"$in": list(uuids)}}, CARD_PROJECTION)}
+
+        return [found[u] for u in uuids if u in found]
+
     @staticmethod
     def get_top_businesses(top: int = 10):
         """
-        Return a random selection of businesses.
+        Return a random selection of businesses as cards.
         Default is 10 businesses.
         """
-        return list(business_profiles.aggregate([{"$sample": {"size": top}}]))
+        return [BusinessCard.from_doc(b) for b in business_profiles.aggregate([{"$sample": {"size": top}}, {"$project": CARD_PROJECTION}])]
 
     @staticmethod
     def create_user(user_data: dict):
         """
         Insert a new user document into the database.
         """
+        _forget_user(user_data.get("uuid"))
+        user_data.setdefault("schema_version", USER_SCHEMA_VERSION)
         return users.insert_one(user_data)
     
     @staticmethod
     def create_business_profile(business_data: dict):
         """
         Insert a new business profile document.
+        Search tokens and stored ranking fields are derived before insert.
         """
-        return business_profiles.insert_one(business_data)
+        _forget_business(business_data.get("uuid"))
+        business_data.update(SearchService.index_fields(business_data.get("name"), business_data.get("description")))
+        business_data.update(rating_fields(business_data.get("combined_rating", 0), business_data.get("users_rated", 0), business_data.get("bookmarks", 0)))
+        business_data.setdefault("version", 1)
+        # Counts present at creation have no user rating behind them (see db.reconcile_ratings)
+        business_data.setdefault("base_combined_rating", business_data.get("combined_rating", 0))
+        business_data.setdefault("base_users_rated", business_data.get("users_rated", 0))
+        business_data.setdefault("schema_version", BUSINESS_SCHEMA_VERSION)
+
+        result = business_profiles.insert_one(business_data)
+        notify_business_change(business_data["uuid"], _coordinates(business_data))
+        return result
 
     @staticmethod
     def link_provider(user_id: str, provider: str, provider_id: str):
         """
         Link an authentication provider (e.g., Google, Facebook) to a user.
         """
+        _forget_user(user_id=user_id)
         users.update_one(
             {"_id": ObjectId(user_id)},
             {"$set": {f"auth.{provider}": provider_id}}
@@ -89,296 +751,834 @@ class db:
         """
         Update a user's profile picture.
         """
-        return users.update_one(
+        _forget_user(user_uuid)
+        result = users.update_one(
             {"uuid": user_uuid},
             {"$set": {"picture": picture_url}}
         )
+
+        # After the write, so a concurrent render cannot re-cache the old picture
+        _author_cache.invalidate(user_uuid)
+        return result
     
     @staticmethod
     def update_business_image(business_uuid: str, picture_url: str):
         """
         Update a business profile image.
         """
-        return business_profiles.update_one(
+        _forget_business(business_uuid)
+        business = business_profiles.find_one_and_update(
             {"uuid": business_uuid},
-            {"$set": {"image_url": picture_url}}
+            {"$set": {"image_url": picture_url}, "$inc": {"version": 1}},
+            projection={"location": 1, "_id": 0}
         )
 
+        notify_business_change(business_uuid, _coordinates(business))
+        return business
+
     @staticmethod
     def update_standard_profile(user_uuid: str, name: str, categories: list):
         """
         Update a standard user's name and category preferences.
         """
-        return users.update_one(
+        _forget_user(user_uuid)
+        result = users.update_one(
             {"uuid": user_uuid},
             {"$set": {"name": name, "categories": categories}}
         )
 
+        _author_cache.invalidate(user_uuid)
+        return result
+
     @staticmethod
     def update_business_profile(user_uuid: str, updated_data: dict):
         """
         Update both the user's display name and the associated business profile data.
         Returns True on success or ValueError on failure.
         """
+        _forget_user(user_uuid)
+        _forget_business(user_uuid)
         try:
+            # Keep search tokens in sync with the searchable text
+            if "name" in updated_data and "description" in updated_data:
+                updated_data = {**updated_data, **SearchService.index_fields(updated_data["name"], updated_data["description"])}
+
             users.update_one(
                 {"uuid": user_uuid},
                 {"$set": {"name": updated_data["name"]}}
             )
+            _author_cache.invalidate(user_uuid)
 
-            business_profiles.update_one(
+            previous = business_profiles.find_one_and_update(
                 {"uuid": user_uuid},
-                {"$set": updated_data}
+                {"$set": updated_data, "$inc": {"version": 1}},
+                projection={"location": 1, "_id": 0}
             )
 
+            # Searches around both the old and the new address may be affected
+            notify_business_change(user_uuid, _coordinates(previous))
+
+            if "location" in updated_data:
+                notify_business_change(user_uuid, _coordinates(updated_data))
+
             return True
         except:
             return ValueError("Something went wrong while updating your profile. Please try again later.")
 
+    @staticmethod
+    def backfill_search_tokens(batch_size: int = 500):
+        """
+        (Re)build search tokens for every business profile.
+        Used once for documents created before tokens existed, and after
+        changes to SearchService tokenization.
+        Returns the number of updated documents.
+        """
+        updated = 0
+        batch = []
+
+        for business in business_profiles.find({}, {"uuid": 1, "name": 1, "description": 1}):
+            batch.append(UpdateOne({"_id": business["_id"]}, {"$set": SearchService.index_fields(business.get("name"), business.get("description"))}))
+
+            if len(batch) == batch_size:
+                updated += business_profiles.bulk_write(batch, ordered=False).modified_count
+                batch = []
+
+        if batch:
+            updated += business_profiles.bulk_write(batch, ordered=False).modified_count
+
+        return updated
+
+    @staticmethod
+    def backfill_rating_fields():
+        """
+        Recompute avg_rating and popularity on every business profile from
+        combined_rating, users_rated and bookmarks (server-side, one command).
+        Used for documents created before the fields existed and to repair drift.
+        Returns the number of modified documents.
+        """
+        return business_profiles.update_many({}, RATING_FIELD_STAGES).modified_count
+
+    # Expired coupons stay visible (as expired) on the owner's dashboard this long
+    COUPON_RETENTION_DAYS = 30
+
+    @staticmethod
+    def get_business_coupons(business_uuid: str, active_only: bool = True) -> dict:
+        """
+        Return a business's coupons keyed by coupon UUID, soonest expiry first.
+        With active_only, only coupons that have not expired (indexed range).
+        """
+        query = {"business_uuid": business_uuid}
+
+        if active_only:
+            query["expiry"] = {"$gte": datetime.now(timezone.utc)}
+
+        return {c["uuid"]: c for c in coupons.find(query, {"_id": 0}).sort("expiry", 1)}
+
     @staticmethod
     def create_coupon(business_uuid: str, coupon: dict):
         """
-        Create a new coupon under a business profile.
-        Coupons are stored as a nested dictionary keyed by UUID.
+        Create a new coupon for a business.
+        Coupons are purged automatically COUPON_RETENTION_DAYS after expiry.
         """
         coupon_id = str(uuid.uuid4())
 
-        return business_profiles.update_one(
-            {"uuid": business_uuid},
-            {"$set": {f"coupons.{coupon_id}": coupon}}
-        )
+        return coupons.insert_one({
+            **coupon,
+            "uuid": coupon_id,
+            "business_uuid": business_uuid,
+            "purge_at": coupon["expiry"] + timedelta(days=db.COUPON_RETENTION_DAYS)
+        })
     
     @staticmethod
     def delete_coupon(business_uuid: str, coupon_id: str):
         """
-        Remove a coupon from a business profile using its UUID.
+        Remove a coupon from a business using its UUID.
         """
-        return business_profiles.update_one(
-            {"uuid": business_uuid},
-            {"$unset": {f"coupons.{coupon_id}": ""}}
-        )
+        return coupons.delete_one({"uuid": coupon_id, "business_uuid": business_uuid})
 
     @staticmethod
-    def add_recent_business(user_uuid: str, business_uuid: str):
+    def migrate_embedded_coupons(business_uuid: str) -> int:
         """
-        Add a business to the user's recently viewed list.
-        Maintains uniqueness and limits to 10 most recent.
+        Move a business's coupons from the embedded `coupons` dict into the
+        coupons collection, then drop the dict. Idempotent (upserts by UUID).
+        Returns the number of copied coupons (0 if already migrated).
         """
-        user = users.find_one({"uuid": user_uuid}, {"recently_viewed": 1})
+        _forget_business(business_uuid)
 
-        if not user:
-            return None
+        business = business_profiles.find_one({"uuid": business_uuid, "coupons": {"$exists": True}}, {"coupons": 1})
+
+        if not business:
+            return 0
 
-        recent_businesses = user.get("recently_viewed", [])
+        embedded = business.get("coupons") or {}
 
-        # Move to front if already exists
-        if business_uuid in recent_businesses:
-            recent_businesses.remove(business_uuid)
+        copies = [
+            UpdateOne(
+                {"uuid": coupon_id},
+                {"$setOnInsert": {
+                    **coupon,
+                    "uuid": coupon_id,
+                    "business_uuid": business_uuid,
+                    "purge_at": coupon["expiry"] + timedelta(days=db.COUPON_RETENTION_DAYS)
+                }},
+                upsert=True
+            )
+            for coupon_id, coupon in embedded.items()
+        ]
 
-        recent_businesses.insert(0, business_uuid)
+        if copies:
+            coupons.bulk_write(copies, ordered=False)
 
-        # Keep only latest 10
-        recent_businesses = recent_businesses[:10]
+        business_profiles.update_one({"_id": business["_id"]}, {"$unset": {"coupons": ""}, "$inc": {"version": 1}})
 
-        users.update_one(
+        return len(copies)
+
+    @staticmethod
+    def add_recent_business(user_uuid: str, business_uuid: str):
+        """
+        Add a business to the user's recently viewed list.
+        Maintains uniqueness and limits to 10 most recent, in one atomic update.
+        Returns the updated list, or None if the user does not exist or the
+        view was buffered (RECENT_VIEWS_WRITE_BEHIND).
+        """
+        if recent_views_buffer is not None:
+            recent_views_buffer.add(user_uuid, [business_uuid])
+            return None
+
+        _forget_user(user_uuid)
+        user = users.find_one_and_update(
             {"uuid": user_uuid},
-            {"$set": {"recently_viewed": recent_businesses}}
+            _recent_views_update([business_uuid]),
+            projection={"recently_viewed": 1, "_id": 0},
+            return_document=ReturnDocument.AFTER
         )
 
-        return recent_businesses
+        return user["recently_viewed"] if user else None
 
     @staticmethod
     def bookmark_business(user_uuid: str, business_uuid: str):
         """
         Toggle bookmark status for a business.
-        Also updates business bookmark counter.
+        Also updates business bookmark counter (sharded, see COUNTER_SHARDS)
+        and, when the shards are folded, the stored popularity.
         Returns bookmark state and updated count.
-        """
-        user = users.find_one({"uuid": user_uuid}, {"bookmarks": 1})
 
-        if not user:
+        The user's bookmark flips in one atomic pipeline update that returns
+        the new state, so concurrent toggles change the counter once per
+        actual change. The business is checked through the request's
+        identity map (the route has already loaded it).
+        """
+        if not db.get_business_info(business_uuid):
             return None
 
-        bookmarks = user.get("bookmarks", [])
-        already_bookmarked = business_uuid in bookmarks
+        _forget_user(user_uuid)
+        _forget_business(business_uuid)
+
+        current = {"$ifNull": ["$bookmarks", []]}
 
-        if already_bookmarked:
-            # Remove bookmark
-            users.update_one({"uuid": user_uuid}, {"$pull": {"bookmarks": business_uuid}})
+        user = users.find_one_and_update(
+            {"uuid": user_uuid},
+            [{"$set": {
+                "bookmarks": {"$cond": [
+                    {"$in": [business_uuid, current]},
+                    {"$filter": {"input": current, "cond": {"$ne": ["$$this", business_uuid]}}},
+                    {"$concatArrays": [current, [business_uuid]]}
+                ]},
+                "feed_dirty": datetime.now(timezone.utc)
+            }}],
+            projection={"bookmarked": {"$in": [business_uuid, "$bookmarks"]}, "_id": 0},
+            return_document=ReturnDocument.AFTER
+        )
 
-            business = business_profiles.find_one_and_update({"uuid": business_uuid, "bookmarks": {"$gt": 0}}, {"$inc": {"bookmarks": -1}}, projection={"bookmarks": 1, "_id": 0}, return_document=ReturnDocument.AFTER)
+        if not user:
+            return None
 
-            return {
-                "bookmarked": False,
-                "business_bookmarks": business["bookmarks"],
-                "business_uuid": business_uuid
-            }
+        bookmarked = user["bookmarked"]
+        business = _apply_counter_deltas(business_uuid, {"bookmarks": 1 if bookmarked else -1})
 
-        else:
-            # Add bookmark
-            users.update_one({"uuid": user_uuid}, {"$addToSet": {"bookmarks": business_uuid}})
+        if not business:
+            return None
 
-            business = business_profiles.find_one_and_update({"uuid": business_uuid}, {"$inc": {"bookmarks": 1}}, projection={"bookmarks": 1, "_id": 0}, return_document=ReturnDocument.AFTER)
+        return {
+            "bookmarked": bookmarked,
+            "business_bookmarks": business["bookmarks"],
+            "business_uuid": business_uuid
+        }
 
-            return {
-                "bookmarked": True,
-                "business_bookmarks": business["bookmarks"],
-                "business_uuid": business_uuid
-            }
+    @staticmethod
+    def fold_counter_shards() -> int:
+        """
+        Fold the bookmark shards of every business that has unfolded counts
+        into its profile (see _fold_counter_shards). Picks up what processes
+        did not fold themselves, e.g. after a crash.
+
+        Returns:
+        - int: Number of folded businesses
+        """
+        return _fold_counter_shards(counter_shards.distinct("business_uuid", {"bookmarks": {"$ne": 0}}))
 
     @staticmethod
     def rate_business(user_uuid: str, business_uuid: str, rating: int):
         """
         Add or update a user's rating for a business.
         Rating must be between 1 and 5.
-        Updates combined rating and total users rated.
+
+        The user's rating and the business counters change in one
+        transaction: the user update returns the previous rating (only
+        `rated.<business_uuid>`), and the business counters and stored
+        avg_rating/popularity move by the difference. Double submits
+        serialize on the user document and each applies the right delta.
+        Rating counters are never buffered.
         """
+        _forget_user(user_uuid)
+        _forget_business(business_uuid)
         if rating < 1 or rating > 5:
             return None
 
-        user = users.find_one({"uuid": user_uuid}, {"rated": 1})
+        projection = {**dict.fromkeys(COUNTER_FIELDS, 1), "location": 1, "_id": 0}
 
-        if not user:
+        def rate(session):
+            user = users.find_one_and_update(
+                {"uuid": user_uuid},
+                {"$set": {f"rated.{business_uuid}": rating, "feed_dirty": datetime.now(timezone.utc)}},
+                projection={f"rated.{business_uuid}": 1, "_id": 0},
+                return_document=ReturnDocument.BEFORE,
+                session=session
+            )
+
+            if not user:
+                session.abort_transaction()
+                return None
+
+            previous_rating = (user.get("rated") or {}).get(business_uuid)
+
+            if previous_rating is None:
+                deltas = {"combined_rating": rating, "users_rated": 1}
+            elif previous_rating != rating:
+                deltas = {"combined_rating": rating - previous_rating}
+            else:
+                deltas = None
+
+            if deltas:
+                business = business_profiles.find_one_and_update(
+                    {"uuid": business_uuid},
+                    _counter_update(deltas),
+                    projection=projection,
+                    return_document=ReturnDocument.AFTER,
+                    session=session
+                )
+            else:
+                business = business_profiles.find_one({"uuid": business_uuid}, projection, session=session)
+
+            # Unknown business: leave the user's ratings unchanged
+            if not business:
+                session.abort_transaction()
+                return None
+
+            return previous_rating, business, bool(deltas)
+
+        # Retried as a whole on transient errors (e.g. write conflicts)
+        with client.start_session() as session:
+            outcome = session.with_transaction(rate)
+
+        if not outcome:
             return None
 
-        rated = user.get("rated", {})
-        previous_rating = rated.get(business_uuid)
+        previous_rating, business, changed = outcome
 
-        if previous_rating is not None:
-            # Update existing rating
-            users.update_one({"uuid": user_uuid}, {"$set": {f"rated.{business_uuid}": rating}})
+        if changed:
+            _counter_read_cache.invalidate(business_uuid)
+            notify_business_change(business_uuid, _coordinates(business))
 
-            business = business_profiles.find_one_and_update({"uuid": business_uuid}, {"$inc": {"combined_rating": rating - previous_rating}}, projection={"combined_rating": 1, "users_rated": 1, "_id": 0}, return_document=ReturnDocument.AFTER)
+        return {
+            "rated": True,
+            "updated": previous_rating is not None,
+            "rating": rating,
+            "business_uuid": business_uuid,
+            "combined_rating": business["combined_rating"],
+            "users_rated": business["users_rated"]
+        }
 
-            return {
-                "rated": True,
-                "updated": True,
-                "rating": rating,
-                "business_uuid": business_uuid,
-                "combined_rating": business["combined_rating"],
-                "users_rated": business["users_rated"]
-            }
+    @staticmethod
+    def reconcile_ratings(batch_size: int = 500) -> int:
+        """
+        Check combined_rating/users_rated of every business against the
+        users' `rated` maps plus the business's base offsets
+        (`base_combined_rating`/`base_users_rated`: seeded or legacy counts
+        with no user rating behind them) and rewrite the ones that drifted,
+        together with avg_rating/popularity.
+
+        A business without base offsets is never corrected: its offsets are
+        recorded as whatever its counts exceed the users' ratings by, so the
+        existing counts are kept.
+
+        Businesses are read with their `version` before users are
+        aggregated, and every rewrite is conditional on that version, so a
+        business rated or bookmarked meanwhile is skipped rather than
+        overwritten (ratings commit together with their counters, see
+        rate_business). Idempotent; returns the number of updated businesses.
+        """
+        snapshot = list(business_profiles.find({}, {
+            "uuid": 1, "version": 1,
+            "combined_rating": 1, "users_rated": 1,
+            "base_combined_rating": 1, "base_users_rated": 1
+        }))
+
+        totals = {
+            row["_id"]: row
+            for row in users.aggregate([
+                {"$match": {"rated": {"$type": "object"}}},
+                {"$project": {"rated": {"$objectToArray": "$rated"}}},
+                {"$unwind": "$rated"},
+                {"$group": {"_id": "$rated.k", "combined_rating": {"$sum": "$rated.v"}, "users_rated": {"$sum": 1}}}
+            ], allowDiskUse=True)
+        }
 
-        else:
-            # New rating
-            users.update_one({"uuid": user_uuid}, {"$set": {f"rated.{business_uuid}": rating}})
+        updated = 0
+        batch = []
 
-            business = business_profiles.find_one_and_update({"uuid": business_uuid}, {"$inc": {"combined_rating": rating, "users_rated": 1}}, projection={"combined_rating": 1, "users_rated": 1, "_id": 0}, return_document=ReturnDocument.AFTER)
+        for business in snapshot:
+            rated = totals.get(business["uuid"], {"combined_rating": 0, "users_rated": 0})
+            combined_rating = business.get("combined_rating", 0)
+            users_rated = business.get("users_rated", 0)
 
-            return {
-                "rated": True,
-                "updated": False,
-                "rating": rating,
-                "business_uuid": business_uuid,
-                "combined_rating": business["combined_rating"],
-                "users_rated": business["users_rated"]
+            if "base_users_rated" in business:
+                fields = {}
+                base_combined_rating = business.get("base_combined_rating", 0)
+                base_users_rated = business["base_users_rated"]
+            else:
+                base_combined_rating = max(combined_rating - rated["combined_rating"], 0)
+                base_users_rated = max(users_rated - rated["users_rated"], 0)
+                fields = {"base_combined_rating": base_combined_rating, "base_users_rated": base_users_rated}
+
+            expected = {
+                "combined_rating": base_combined_rating + rated["combined_rating"],
+                "users_rated": base_users_rated + rated["users_rated"]
             }
 
+            if expected != {"combined_rating": combined_rating, "users_rated": users_rated}:
+                fields.update(expected)
+
+            if not fields:
+                continue
+
+            batch.append(UpdateOne(
+                {"_id": business["_id"], "version": business.get("version")},
+                [{"$set": {field: {"$literal": value} for field, value in fields.items()}}] + _counter_update({})
+            ))
+
+            if len(batch) == batch_size:
+                updated += business_profiles.bulk_write(batch, ordered=False).modified_count
+                batch = []
+
+        if batch:
+            updated += business_profiles.bulk_write(batch, ordered=False).modified_count
+
+        return updated
+
+    # Sort orders for comment pages, each served by its own index; uuid
+    # breaks ties so every comment has a unique position for cursors
+    COMMENT_SORTS = {
+        "newest": [("created", -1), ("uuid", -1)],
+        "most_helpful": [("likes", -1), ("created", -1), ("uuid", -1)]
+    }
+
+    @staticmethod
+    def get_business_comments(business_uuid: str, page: int = 1, per_page: int = 10, sort: str = "newest", cursor: str = None):
+        """
+        Return one page of a business's comments, sorted server-side.
+        The total is the `comment_count` stored on the business profile.
+
+        When a cursor (from comment_cursor) is given, the page starts right
+        after the comment it encodes and page is ignored: every page is one
+        index range scan, however deep. Without one (direct page jumps),
+        the page is found with skip.
+
+        Parameters:
+        - business_uuid (str): Business UUID.
+        - page (int): 1-based page number.
+        - per_page (int): Comments per page.
+        - sort (str): "newest" or "most_helpful".
+        - cursor (str): Token from comment_cursor for the previous page.
+
+        Returns:
+        - list[dict]: Comment documents (without _id)
+        """
+        if sort not in db.COMMENT_SORTS:
+            sort = "newest"
+
+        order = db.COMMENT_SORTS[sort]
+        after = _decode_comment_cursor(cursor, sort)
+        query = {"business_uuid": business_uuid}
+
+        if after:
+            # Everything strictly after the last comment in (key1, key2, ..., uuid) order
+            fields = [field for field, _ in order]
+            query["$or"] = [
+                {**{fields[j]: after[j] for j in range(i)}, fields[i]: {"$lt": after[i]}}
+                for i in range(len(fields))
+            ]
+
+        page_query = comments.find(query, {"_id": 0, "liked_by": 0}).sort(order)
+
+        if not after:
+            page_query = page_query.skip((max(page, 1) - 1) * per_page)
+
+        page_comments = list(page_query.limit(per_page))
+
+        # Likes of comments in the old layout must be in comment_likes before they are read
+        stale = [c["uuid"] for c in page_comments if c.get("schema_version", 0) < COMMENT_SCHEMA_VERSION]
+
+        if stale:
+            upgrade_comments(list(comments.find({"uuid": {"$in": stale}}, COMMENT_UPGRADE_PROJECTION)))
+
+        return page_comments
+
+    @staticmethod
+    def comment_cursor(page_comments: list, sort: str = "newest"):
+        """
+        Build the opaque token for the page after `page_comments`
+        (the sort key of its last comment).
+
+        Returns:
+        - str token, or None if the page is empty
+        """
+        if not page_comments:
+            return None
+
+        if sort not in db.COMMENT_SORTS:
+            sort = "newest"
+
+        last = page_comments[-1]
+        key = [last[field] for field, _ in db.COMMENT_SORTS[sort]]
+        payload = json.dumps([value.isoformat() if isinstance(value, datetime) else value for value in key], separators=(",", ":"))
+
+        return base64.urlsafe_b64encode(payload.encode()).decode().rstrip("=")
+
     @staticmethod
     def add_business_comment(business_uuid, user_uuid, text):
         """
-        Add a comment to a business profile.
+        Add a comment to a business.
         Includes:
         - Profanity filtering
-        - 30-second rate limit per user
-        - Duplicate comment detection
+        - 30-second rate limit per user and business (token bucket)
+        - Duplicate comment detection (normalized text hash, indexed)
         """
-        business = business_profiles.find_one(
-            {"uuid": business_uuid},
-            {"comments": 1}
-        )
+        _forget_business(business_uuid)
+
+        business = business_profiles.find_one({"uuid": business_uuid}, {"schema_version": 1})
 
         if not business:
             return None
 
-        comments = business.get("comments")
-
-        # Ensure comments field exists and is a dictionary
-        if not isinstance(comments, dict):
-            business_profiles.update_one(
-                {"uuid": business_uuid},
-                {"$set": {"comments": {}}}
-            )
-            comments = {}
-
-        now = datetime.now(timezone.utc)
+        # Embedded comments must be in the collection, and hashed from their censored
+        # text, before checking duplicates; a current business has nothing to upgrade
+        if business.get("schema_version", 0) < BUSINESS_SCHEMA_VERSION:
+            upgrade_businesses(list(business_profiles.find({"_id": business["_id"]}, BUSINESS_UPGRADE_PROJECTION)))
 
-        # Rate limit and duplicate check
-        for c in comments.values():
-            if c["author_uuid"] == user_uuid:
-                created = c["created"]
+        censored = profanity.censor(text)
+        text_hash = comment_text_hash(censored)
 
-                if created.tzinfo is None:
-                    created = created.replace(tzinfo=timezone.utc)
-                
-                if (now - created).total_seconds() < 30:
-                    return "RATE_LIMIT"
+        # Checked before taking a token, so rejected duplicates don't use up the rate limit
+        if comments.find_one({"business_uuid": business_uuid, "author_uuid": user_uuid, "text_hash": text_hash}, {"_id": 1}):
+            return "DUPLICATE"
 
-                if c["comment"].lower() == text.lower():
-                    return "DUPLICATE"
+        if not comment_limiter.allow(f"comment:{user_uuid}:{business_uuid}"):
+            return "RATE_LIMIT"
 
+        now = datetime.now(timezone.utc)
         comment_uuid = str(uuid.uuid4())
 
-        comment = {
+        comments.insert_one({
+            "uuid": comment_uuid,
+            "business_uuid": business_uuid,
             "author_uuid": user_uuid,
-            "comment": profanity.censor(text),
+            "comment": censored,
+            "text_hash": text_hash,
             "likes": 0,
-            "liked_by": [],
-            "created": now
-        }
+            "created": now,
+            "schema_version": COMMENT_SCHEMA_VERSION
+        })
 
         business_profiles.update_one(
             {"uuid": business_uuid},
-            {"$set": {f"comments.{comment_uuid}": comment}}
+            {"$inc": {"comment_count": 1, "version": 1}}
         )
 
         return comment_uuid
 
     @staticmethod
-    def toggle_comment_like(business_uuid, comment_uuid, user_uuid):
+    def migrate_embedded_comments(business_uuid: str) -> int:
         """
-        Toggle like/unlike on a specific comment.
-        Updates like counter and liked_by array atomically.
+        Move a business's comments from the embedded `comments` dict into the
+        comments collection, then drop the dict and store `comment_count`.
+
+        Idempotent and safe while the app is running: copies are upserted by
+        comment UUID, and the dict is only removed once every copy exists.
+        Returns the number of copied comments (0 if already migrated).
         """
-        path = f"comments.{comment_uuid}"
+        _forget_business(business_uuid)
 
-        business = business_profiles.find_one(
-            {"uuid": business_uuid, path: {"$exists": True}},
-            {path: 1}
-        )
+        business = business_profiles.find_one({"uuid": business_uuid, "comments": {"$exists": True}}, {"comments": 1})
 
         if not business:
-            return None
+            return 0
 
-        comment = business["comments"][comment_uuid]
+        embedded = business.get("comments") or {}
 
-        if user_uuid in comment.get("liked_by", []):
-            # Unlike comment
-            business_profiles.update_one(
-                {"uuid": business_uuid},
-                {
-                    "$pull": {f"{path}.liked_by": user_uuid},
-                    "$inc": {f"{path}.likes": -1}
-                }
-            )
-            liked = False
-        else:
-            # Like comment
-            business_profiles.update_one(
-                {"uuid": business_uuid},
-                {
-                    "$addToSet": {f"{path}.liked_by": user_uuid},
-                    "$inc": {f"{path}.likes": 1}
-                }
+        copies = [
+            UpdateOne(
+                {"uuid": comment_uuid},
+                {"$setOnInsert": {
+                    "uuid": comment_uuid,
+                    "business_uuid": business_uuid,
+                    "author_uuid": c["author_uuid"],
+                    "comment": c["comment"],
+                    "text_hash": comment_text_hash(c["comment"]),
+                    "likes": int(c.get("likes", 0)),
+                    "created": c["created"],
+                    "schema_version": COMMENT_SCHEMA_VERSION
+                }},
+                upsert=True
             )
-            liked = True
+            for comment_uuid, c in embedded.items()
+        ]
 
-        updated = business_profiles.find_one(
-            {"uuid": business_uuid},
-            {f"{path}.likes": 1}
+        if copies:
+            comments.bulk_write(copies, ordered=False)
+
+        _store_likes([(comment_uuid, user_uuid) for comment_uuid, c in embedded.items() for user_uuid in c.get("liked_by", [])])
+
+        # Counted from the collection, so re-runs are included. Only stored if
+        # still missing: once set, add_business_comment's $inc keeps it current
+        # and a late count must not overwrite it.
+        count = comments.count_documents({"business_uuid": business_uuid})
+
+        business_profiles.update_one(
+            {"_id": business["_id"]},
+            [
+                {"$set": {
+                    "comment_count": {"$ifNull": ["$comment_count", count]},
+                    "version": {"$add": [{"$ifNull": ["$version", 0]}, 1]}
+                }},
+                {"$unset": "comments"}
+            ]
         )
 
+        return len(copies)
+
+    @staticmethod
+    def toggle_comment_like(business_uuid, comment_uuid, user_uuid):
+        """
+        Toggle like/unlike on a specific comment.
+
+        The like state flips atomically in the user's comment_likes document
+        (no read first) and the comment's counter moves by the same step in
+        one transaction, which returns the new count. The counter update only
+        matches current comments; when it matches nothing the flip is rolled
+        back, and only then is the business (embedded comments) or the
+        comment (likes still in a liked_by array, which would count twice)
+        upgraded before one retry. Unknown comments write nothing.
+        """
+        query = {"uuid": comment_uuid, "business_uuid": business_uuid}
+
+        def toggle(session):
+            like = comment_likes.find_one_and_update(
+                {"user_uuid": user_uuid, "comment_uuid": comment_uuid},
+                [{"$set": {"liked": {"$not": [{"$ifNull": ["$liked", False]}]}, "updated": "$$NOW"}}],
+                projection={"liked": 1, "_id": 0},
+                upsert=True,
+                return_document=ReturnDocument.AFTER,
+                session=session
+            )
+
+            updated = comments.find_one_and_update(
+                {**query, "schema_version": {"$gte": COMMENT_SCHEMA_VERSION}},
+                {"$inc": {"likes": 1 if like["liked"] else -1}},
+                projection={"likes": 1, "_id": 0},
+                return_document=ReturnDocument.AFTER,
+                session=session
+            )
+
+            # Unknown or stale comment: undo the flip
+            if not updated:
+                session.abort_transaction()
+                return None
+
+            return {"liked": like["liked"], "likes": updated["likes"]}
+
+        # Retried as a whole on transient errors (e.g. write conflicts)
+        with client.start_session() as session:
+            result = session.with_transaction(toggle)
+
+            if result:
+                return result
+
+            business = business_profiles.find_one({"uuid": business_uuid}, {"schema_version": 1})
+
+            if not business:
+                return None
+
+            # A stale business may still embed the comment; a current one only has stale comments written by old instances
+            if business.get("schema_version", 0) < BUSINESS_SCHEMA_VERSION:
+                upgrade_businesses(list(business_profiles.find({"_id": business["_id"]}, BUSINESS_UPGRADE_PROJECTION)))
+            elif not upgrade_comments(list(comments.find({**query, "schema_version": {"$not": {"$gte": COMMENT_SCHEMA_VERSION}}}, COMMENT_UPGRADE_PROJECTION))):
+                return None
+
+            return session.with_transaction(toggle)
+
+    @staticmethod
+    def get_liked_comments(user_uuid: str, comment_uuids: list) -> set:
+        """
+        Return which of the given comments the user currently likes (one indexed query).
+        """
+        if not comment_uuids:
+            return set()
+
         return {
-            "liked": liked,
-            "likes": updated["comments"][comment_uuid]["likes"]
+            like["comment_uuid"]
+            for like in comment_likes.find(
+                {"user_uuid": user_uuid, "comment_uuid": {"$in": list(comment_uuids)}, "liked": True},
+                {"comment_uuid": 1, "_id": 0}
+            )
         }
+
+
+def _present(field: str) -> dict:
+    """
+    Projection expression: True if the document has `field`.
+    """
+    return {"$ne": [{"$type": f"${field}"}, "missing"]}
+
+# What upgrade_businesses needs to know about a profile (not the embedded data itself)
+BUSINESS_UPGRADE_PROJECTION = {
+    "uuid": 1,
+    "name": 1,
+    "description": 1,
+    "combined_rating": 1,
+    "users_rated": 1,
+    "bookmarks": 1,
+    "schema_version": 1,
+    "has_comments": _present("comments"),
+    "has_coupons": _present("coupons"),
+    "has_search_tokens": _present("search_tokens"),
+    "has_rating_fields": {"$and": [_present("avg_rating"), _present("popularity")]},
+    "has_comment_count": _present("comment_count")
+}
+
+def upgrade_businesses(docs: list) -> int:
+    """
+    Bring business profiles (projected with BUSINESS_UPGRADE_PROJECTION) to
+    BUSINESS_SCHEMA_VERSION:
+    - embedded comments and coupons move to their collections
+    - search tokens, avg_rating/popularity and comment_count are filled in
+    - the business's comments are brought to COMMENT_SCHEMA_VERSION (version 2)
+
+    Idempotent; each profile is one short single-document write.
+    Returns the number of upgraded profiles.
+    """
+    updates = []
+
+    # Before the profiles are marked current, so an interrupted upgrade is retried
+    upgrade_comments(list(comments.find(
+        {"business_uuid": {"$in": [doc["uuid"] for doc in docs]}, "schema_version": {"$not": {"$gte": COMMENT_SCHEMA_VERSION}}},
+        COMMENT_UPGRADE_PROJECTION
+    )))
+
+    for doc in docs:
+        # These drop the embedded data and set comment_count themselves
+        if doc.get("has_comments"):
+            db.migrate_embedded_comments(doc["uuid"])
+        if doc.get("has_coupons"):
+            db.migrate_embedded_coupons(doc["uuid"])
+
+        fields = {"schema_version": {"$literal": BUSINESS_SCHEMA_VERSION}}
+
+        if not doc.get("has_search_tokens"):
+            fields.update({field: {"$literal": value} for field, value in SearchService.index_fields(doc.get("name"), doc.get("description")).items()})
+
+        if not doc.get("has_rating_fields"):
+            fields.update({field: {"$literal": value} for field, value in rating_fields(doc.get("combined_rating", 0), doc.get("users_rated", 0), doc.get("bookmarks", 0)).items()})
+
+        # Never overwrites a count that add_business_comment has started to $inc
+        if not doc.get("has_comment_count") and not doc.get("has_comments"):
+            fields["comment_count"] = {"$ifNull": ["$comment_count", comments.count_documents({"business_uuid": doc["uuid"]})]}
+
+        fields["version"] = {"$add": [{"$ifNull": ["$version", 0]}, 1]}
+
+        updates.append(UpdateOne(
+            {"_id": doc["_id"], "schema_version": {"$not": {"$gte": BUSINESS_SCHEMA_VERSION}}},
+            [{"$set": fields}]
+        ))
+
+    if not updates:
+        return 0
+
+    return business_profiles.bulk_write(updates, ordered=False).modified_count
+
+def _load_business(business_uuid: str):
+    """
+    Read a business profile, upgrading it first if it is in an older layout.
+    """
+    business = business_profiles.find_one({"uuid": business_uuid})
+
+    if business and business.get("schema_version", 0) < BUSINESS_SCHEMA_VERSION:
+        upgrade_businesses(list(business_profiles.find({"_id": business["_id"]}, BUSINESS_UPGRADE_PROJECTION)))
+        business = business_profiles.find_one({"_id": business["_id"]})
+
+    return business
+
+# Fields every user document has since USER_SCHEMA_VERSION 1
+USER_DEFAULTS = {"bookmarks": [], "recently_viewed": [], "rated": {}, "categories": []}
+
+USER_UPGRADE_PROJECTION = {"_id": 1}
+
+def upgrade_users(docs: list) -> int:
+    """
+    Bring users to USER_SCHEMA_VERSION: missing list/map fields get their
+    empty defaults (one server-side update for the whole batch).
+    Returns the number of upgraded users.
+    """
+    if not docs:
+        return 0
+
+    return users.update_many(
+        {"_id": {"$in": [doc["_id"] for doc in docs]}, "schema_version": {"$not": {"$gte": USER_SCHEMA_VERSION}}},
+        [{"$set": {
+            **{field: {"$ifNull": [f"${field}", default]} for field, default in USER_DEFAULTS.items()},
+            "schema_version": USER_SCHEMA_VERSION
+        }}]
+    ).modified_count
+
+def _user_compat(user):
+    """
+    Read-side compatibility for users not upgraded yet (nothing is written).
+    """
+    if user and user.get("schema_version", 0) < USER_SCHEMA_VERSION:
+        for field, default in USER_DEFAULTS.items():
+            user.setdefault(field, type(default)())
+
+    return user
+
+COMMENT_UPGRADE_PROJECTION = {"uuid": 1, "comment": 1, "liked_by": 1}
+
+def upgrade_comments(docs: list) -> int:
+    """
+    Bring comments to COMMENT_SCHEMA_VERSION: `liked_by` arrays move to
+    comment_likes and `text_hash` is (re)computed from the stored, censored
+    text (version 2; version 1 comments may hash the raw text).
+    Returns the number of upgraded comments.
+    """
+    if not docs:
+        return 0
+
+    _store_likes([(doc["uuid"], user_uuid) for doc in docs for user_uuid in doc.get("liked_by") or []])
+
+    updates = []
+
+    for doc in docs:
+        fields = {"schema_version": COMMENT_SCHEMA_VERSION, "text_hash": comment_text_hash(doc["comment"])}
+
+        updates.append(UpdateOne({"_id": doc["_id"]}, {"$set": fields, "$unset": {"liked_by": ""}}))
+
+    return comments.bulk_write(updates, ordered=False).modified_count
@@ -1,5 +1,23 @@
+import logging
+import os
 import re
+import threading
+import time
+import unicodedata
 import requests
+from datetime import datetime, timedelta, timezone
+from pymongo.errors import PyMongoError
+from services.CacheService import SingleFlight, TTLCache
+from services.DatabaseService import geocode_cache, rate_limits
+from services.RateLimiter import MongoBucketStore, TokenBucket
+
+logger = logging.getLogger(__name__)
+
+class GeocodingBusyError(Exception):
+    """
+    Raised instead of queueing when too many lookups are already waiting
+    for their turn at the Nominatim rate limit.
+    """
 
 class GeocodingService:
     """
@@ -7,10 +25,50 @@ class GeocodingService:
     geographic coordinates (latitude, longitude).
 
     Uses the OpenStreetMap Nominatim API for geocoding.
+
+    Results are cached by canonical address (see canonical_key) in the
+    `geocode_cache` collection, which survives restarts and is shared by
+    every process, behind an in-process LRU so repeat lookups never leave
+    the process. "Address not found" answers are cached too, for a shorter
+    time; service errors are not cached.
+
+    Cache misses are throttled to Nominatim's one request per second
+    (per process, or across processes with RATE_LIMIT_BACKEND=mongo), and concurrent lookups of the same address share one
+    upstream request. When more than MAX_QUEUED lookups are already
+    waiting, a lookup fails immediately with GeocodingBusyError.
     """
 
-    # Base endpoint for Nominatim search API
-    BASE_URL = "https://nominatim.openstreetmap.org/search"
+    # Base endpoint for Nominatim search API (override to point at a local stub)
+    BASE_URL = os.getenv("NOMINATIM_URL", "https://nominatim.openstreetmap.org/search")
+
+    # Nominatim usage policy: at most one request per second
+    INTERVAL_SECONDS = float(os.getenv("GEOCODE_INTERVAL_SECONDS", 1))
+    MAX_QUEUED = int(os.getenv("GEOCODE_MAX_QUEUED", 5))
+    REQUEST_TIMEOUT_SECONDS = 10
+
+    # Per process by default; RATE_LIMIT_BACKEND=mongo shares one bucket
+    # between all app processes, which is what the policy requires when
+    # running more than one worker
+    _limiter = TokenBucket(
+        capacity=1,
+        refill_seconds=INTERVAL_SECONDS,
+        store=MongoBucketStore(rate_limits) if os.getenv("RATE_LIMIT_BACKEND") == "mongo" else None
+    )
+    _inflight = SingleFlight()
+
+    # How long answers stay in geocode_cache (MongoDB TTL index on `expires`)
+    FOUND_TTL = timedelta(days=90)
+    NOT_FOUND_TTL = timedelta(hours=24)
+
+    # In-process copy of recent answers
+    MEMORY_TTL_SECONDS = 3600
+    _memory = TTLCache(maxsize=10000, ttl=MEMORY_TTL_SECONDS)
+
+    # Cached value for addresses Nominatim has no result for
+    _NOT_FOUND = "not_found"
+
+    _stats = {"store_hits": 0, "store_misses": 0, "negative_hits": 0, "upstream_lookups": 0, "store_errors": 0, "upstream_errors": 0, "rejected": 0}
+    _stats_lock = threading.Lock()
 
     @staticmethod
     def _sanitize_address(address: str) -> str:
@@ -49,29 +107,91 @@ class GeocodingService:
         return cleaned.strip()
 
     @staticmethod
-    def geocode(address: str, city: str, province: str, country="Canada"):
+    def canonical_key(address: str, city: str, province: str, country="Canada") -> str:
         """
-        Convert an address into latitude and longitude coordinates.
+        Cache key for an address: the sanitized street address plus city,
+        province and country, each Unicode-normalized, casefolded, stripped
+        of periods/commas and with whitespace collapsed.
 
-        Parameters:
-        - address (str): Street address (e.g., "123 Main St").
-        - city (str): City name.
-        - province (str): Province or state.
-        - country (str): Country name (default: Canada).
+        Example: "12 Main St., Suite 4" / "Toronto" / "ON"
+        -> "12 main st|toronto|on|canada"
+        """
+        parts = [GeocodingService._sanitize_address(address or ""), city or "", province or "", country or ""]
+
+        return "|".join(
+            " ".join(re.sub(r"[.,]", " ", unicodedata.normalize("NFKC", part).casefold()).split())
+            for part in parts
+        )
+
+    @staticmethod
+    def _count(name: str):
+        with GeocodingService._stats_lock:
+            GeocodingService._stats[name] += 1
+
+    @staticmethod
+    def _cached(key: str):
+        """
+        Return the cached answer for key: (lat, lng), _NOT_FOUND, or None on a miss.
+        """
+        value = GeocodingService._memory.get(key)
+
+        if value is not None:
+            return value
+
+        now = datetime.now(timezone.utc)
+
+        # The TTL monitor runs about once a minute, so expiry is also checked here.
+        # The cache is optional: if MongoDB fails, the lookup goes upstream.
+        try:
+            doc = geocode_cache.find_one({"_id": key, "expires": {"$gt": now}}, {"coords": 1})
+        except PyMongoError:
+            GeocodingService._count("store_errors")
+            logger.warning("Geocode cache read failed, asking Nominatim", exc_info=True)
+            return None
+
+        if not doc:
+            GeocodingService._count("store_misses")
+            return None
+
+        GeocodingService._count("store_hits")
+
+        value = tuple(doc["coords"]) if doc.get("coords") else GeocodingService._NOT_FOUND
+        GeocodingService._memory.set(key, value)
+
+        return value
+
+    @staticmethod
+    def _store(key: str, coords):
+        """
+        Cache an upstream answer: (lat, lng), or None for "not found".
+        """
+        now = datetime.now(timezone.utc)
+        ttl = GeocodingService.FOUND_TTL if coords else GeocodingService.NOT_FOUND_TTL
+
+        GeocodingService._memory.set(key, coords or GeocodingService._NOT_FOUND)
+
+        try:
+            geocode_cache.update_one(
+                {"_id": key},
+                {"$set": {"coords": list(coords) if coords else None, "updated": now, "expires": now + ttl}},
+                upsert=True
+            )
+        except PyMongoError:
+            GeocodingService._count("store_errors")
+            logger.warning("Geocode cache write failed", exc_info=True)
+
+    @staticmethod
+    def _fetch(query: str):
+        """
+        Ask Nominatim for a query.
 
         Returns:
-        - (float, float): Tuple containing (latitude, longitude).
+        - (float, float): (latitude, longitude), or None if nothing was found.
 
         Raises:
         - Exception: If external service returns non-200 status.
-        - ValueError: If no results are found.
         """
-
-        # Clean address to improve matching accuracy
-        clean_address = GeocodingService._sanitize_address(address)
-
-        # Construct full query string
-        query = f"{clean_address}, {city}, {province}, {country}"
+        GeocodingService._count("upstream_lookups")
 
         # Send GET request to Nominatim API
         response = requests.get(
@@ -85,18 +205,105 @@ class GeocodingService:
                 # Required by Nominatim usage policy
                 "User-Agent": "businessly/1.0 (benny@fxk3b.com)"
             },
-            timeout=10  # Prevent hanging requests
+            timeout=GeocodingService.REQUEST_TIMEOUT_SECONDS  # Prevent hanging requests
         )
 
         # Check for API failure
         if response.status_code != 200:
+            GeocodingService._count("upstream_errors")
             raise Exception("Geocoding service error")
 
         data = response.json()
 
         # No results returned
         if not data:
-            raise ValueError("Address not found")
+            return None
 
         # Return latitude and longitude as floats
         return float(data[0]["lat"]), float(data[0]["lon"])
+
+    @staticmethod
+    def _wait_turn():
+        """
+        Block until this process may send the next Nominatim request.
+
+        Raises:
+        - GeocodingBusyError: If MAX_QUEUED requests are already waiting.
+        """
+        wait = GeocodingService._limiter.reserve("nominatim", max_wait=GeocodingService.MAX_QUEUED * GeocodingService.INTERVAL_SECONDS)
+
+        if wait is None:
+            GeocodingService._count("rejected")
+            raise GeocodingBusyError("Too many address lookups in progress, try again shortly")
+
+        if wait:
+            time.sleep(wait)
+
+    @staticmethod
+    def _lookup(key: str, address: str, city: str, province: str, country: str):
+        """
+        Resolve a cache miss upstream and cache the answer.
+        Returns (lat, lng), or None if the address was not found.
+        """
+        # A lookup for this key may have finished between our cache check and now
+        coords = GeocodingService._memory.get(key)
+
+        if coords is None:
+            # Clean address to improve matching accuracy
+            clean_address = GeocodingService._sanitize_address(address)
+
+            # Construct full query string
+            query = f"{clean_address}, {city}, {province}, {country}"
+
+            GeocodingService._wait_turn()
+            coords = GeocodingService._fetch(query)
+            GeocodingService._store(key, coords)
+
+        return None if coords == GeocodingService._NOT_FOUND else coords
+
+    @staticmethod
+    def geocode(address: str, city: str, province: str, country="Canada"):
+        """
+        Convert an address into latitude and longitude coordinates.
+
+        Parameters:
+        - address (str): Street address (e.g., "123 Main St").
+        - city (str): City name.
+        - province (str): Province or state.
+        - country (str): Country name (default: Canada).
+
+        Returns:
+        - (float, float): Tuple containing (latitude, longitude).
+
+        Raises:
+        - Exception: If external service returns non-200 status.
+        - ValueError: If no results are found.
+        - GeocodingBusyError: If too many lookups are queued for Nominatim.
+        """
+        key = GeocodingService.canonical_key(address, city, province, country)
+        coords = GeocodingService._cached(key)
+
+        if coords is None:
+            # Concurrent misses for the same address wait for one lookup
+            coords = GeocodingService._inflight.do(key, lambda: GeocodingService._lookup(key, address, city, province, country))
+        elif coords == GeocodingService._NOT_FOUND:
+            GeocodingService._count("negative_hits")
+            coords = None
+
+        # No results returned
+        if not coords:
+            raise ValueError("Address not found")
+
+        return coords
+
+    @staticmethod
+    def cache_stats() -> dict:
+        """
+        In-process cache counters plus persistent cache and upstream counters.
+        """
+        with GeocodingService._stats_lock:
+            counters = dict(GeocodingService._stats)
+
+        counters["coalesced"] = GeocodingService._inflight.shared
+
+        return {"memory": GeocodingService._memory.stats(), **counters}
@@ -0,0 +1,109 @@
+import time
+from datetime import datetime, timezone
+from services.DatabaseService import (
+    business_profiles, users, comments, migrations,
+    BUSINESS_SCHEMA_VERSION, USER_SCHEMA_VERSION, COMMENT_SCHEMA_VERSION,
+    BUSINESS_UPGRADE_PROJECTION, USER_UPGRADE_PROJECTION, COMMENT_UPGRADE_PROJECTION,
+    upgrade_businesses, upgrade_users, upgrade_comments
+)
+
+class MigrationService:
+    """
+    Online schema migrations: documents below their collection's schema
+    version are upgraded in small `_id`-ordered batches with a pause in
+    between, so the app keeps serving traffic while a migration runs.
+
+    Progress (last `_id` done) is checkpointed in the `migrations`
+    collection after every batch; an interrupted run resumes from there.
+    A finished migration is scanned again whenever stale documents show
+    up later (e.g. written by old instances during a rolling deploy).
+    Upgrades are idempotent and the read path upgrades (or adapts)
+    documents it meets first, so old and new layouts can coexist for as
+    long as a migration takes.
+    """
+
+    # name -> (collection, target schema_version, projection, upgrade(docs) -> count)
+    MIGRATIONS = {
+        "businesses": (business_profiles, BUSINESS_SCHEMA_VERSION, BUSINESS_UPGRADE_PROJECTION, upgrade_businesses),
+        "users": (users, USER_SCHEMA_VERSION, USER_UPGRADE_PROJECTION, upgrade_users),
+        "comments": (comments, COMMENT_SCHEMA_VERSION, COMMENT_UPGRADE_PROJECTION, upgrade_comments)
+    }
+
+    @staticmethod
+    def _stale(version: int) -> dict:
+        # Matches documents without schema_version too
+        return {"schema_version": {"$not": {"$gte": version}}}
+
+    @staticmethod
+    def run(name: str, batch_size: int = 500, pause_seconds: float = 0.1, max_batches: int = None) -> dict:
+        """
+        Upgrade every stale document of one migration, resuming from its checkpoint.
+
+        Parameters:
+        - name (str): Key of MIGRATIONS.
+        - batch_size (int): Documents read and upgraded per batch.
+        - pause_seconds (float): Sleep between batches (throttle).
+        - max_batches (int): Stop after this many batches (None = until done).
+
+        Returns:
+        - dict: {"scanned", "upgraded", "done"}
+        """
+        collection, version, projection, upgrade = MigrationService.MIGRATIONS[name]
+        checkpoint_id = f"{name}:v{version}"
+
+        checkpoint = migrations.find_one({"_id": checkpoint_id}) or {}
+        stats = {"scanned": 0, "upgraded": 0, "done": checkpoint.get("done", False)}
+        last_id = checkpoint.get("last_id")
+        batches = 0
+
+        # Old app instances (rolling deploys) may still write stale documents
+        # after a finished scan, possibly below the checkpoint: scan again
+        if stats["done"] and MigrationService.pending(name):
+            stats["done"] = False
+            last_id = None
+
+        while not stats["done"] and (max_batches is None or batches < max_batches):
+            query = MigrationService._stale(version)
+            if last_id is not None:
+                query["_id"] = {"$gt": last_id}
+
+            # _id order makes the checkpoint a simple range bound
+            batch = list(collection.find(query, projection).sort("_id", 1).limit(batch_size))
+
+            if batch:
+                stats["scanned"] += len(batch)
+                stats["upgraded"] += upgrade(batch)
+                last_id = batch[-1]["_id"]
+
+            stats["done"] = len(batch) < batch_size
+            batches += 1
+
+            migrations.update_one(
+                {"_id": checkpoint_id},
+                {
+                    "$set": {"last_id": last_id, "done": stats["done"], "updated": datetime.now(timezone.utc)},
+                    "$inc": {"scanned": len(batch), "batches": 1}
+                },
+                upsert=True
+            )
+
+            if not stats["done"] and pause_seconds:
+                time.sleep(pause_seconds)
+
+        return stats
+
+    @staticmethod
+    def pending(name: str) -> int:
+        """
+        Number of documents still below the target schema version.
+        """
+        collection, version, _, _ = MigrationService.MIGRATIONS[name]
+        return collection.count_documents(MigrationService._stale(version))
+
+    @staticmethod
+    def reset(name: str):
+        """
+        Forget a migration's checkpoint, so the next run scans from the start.
+        """
+        _, version, _, _ = MigrationService.MIGRATIONS[name]
+        migrations.delete_one({"_id": f"{name}:v{version}"})
@@ -0,0 +1,105 @@
+import contextvars
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+
+logger = logging.getLogger(__name__)
+
+class ParallelLoader:
+    """
+    Runs independent data-loading branches of a request concurrently on a
+    shared, bounded thread pool.
+
+    Each branch has its own timeout and fallback value: a branch that raises
+    or is not done in time is replaced by its fallback (and logged) so the
+    page still renders. Page latency becomes the slowest branch instead of
+    the sum of all branches.
+
+    Timeouts start when a branch starts running, not while it waits for a
+    worker. A branch still queued when the caller gets to it is taken back
+    and run in the caller's thread, so a saturated pool makes pages slower
+    instead of silently empty. Fallbacks are counted in stats().
+
+    Branches run in a copy of the caller's context, so they share the
+    request's RequestScope (identity map and query counter). They do not
+    have a Flask app/request context; resolve anything that needs `g` or
+    `request` before submitting.
+    """
+
+    # Upper bound on concurrently running branches across all requests.
+    # A timed-out branch keeps its worker until the query returns.
+    MAX_WORKERS = 16
+
+    _executor = ThreadPoolExecutor(max_workers=MAX_WORKERS, thread_name_prefix="loader")
+
+    _stats = {"branches": 0, "inline": 0, "timeouts": 0, "errors": 0}
+    _stats_lock = threading.Lock()
+
+    @staticmethod
+    def _count(name: str):
+        with ParallelLoader._stats_lock:
+            ParallelLoader._stats[name] += 1
+
+    @staticmethod
+    def gather(branches: dict) -> dict:
+        """
+        Run every branch concurrently and wait for all of them.
+
+        Parameters:
+        - branches (dict): name -> (callable, timeout_seconds, fallback)
+
+        Returns:
+        - dict: name -> result, or the branch's fallback on error/timeout
+        """
+        started = {}
+
+        def run(name, context, load):
+            started[name] = time.monotonic()
+            return context.run(load)
+
+        contexts = {name: contextvars.copy_context() for name in branches}
+        futures = {
+            name: ParallelLoader._executor.submit(run, name, contexts[name], load)
+            for name, (load, _, _) in branches.items()
+        }
+
+        results = {}
+
+        for name, (load, timeout, fallback) in branches.items():
+            future = futures[name]
+            ParallelLoader._count("branches")
+
+            try:
+                # Still waiting for a worker: run it here rather than time out in the queue
+                if future.cancel():
+                    ParallelLoader._count("inline")
+                    results[name] = contexts[name].run(load)
+                    continue
+
+                # Running or done; the timeout counts from when it started
+                remaining = max(timeout - (time.monotonic() - started.get(name, time.monotonic())), 0)
+                results[name] = future.result(timeout=remaining)
+            except FutureTimeoutError:
+                ParallelLoader._count("timeouts")
+                logger.warning("Branch %r timed out after %.2fs, using fallback", name, timeout)
+                results[name] = fallback
+            except Exception:
+                ParallelLoader._count("errors")
+                logger.exception("Branch %r failed, using fallback", name)
+                results[name] = fallback
+
+        return results
+
+    @staticmethod
+    def stats() -> dict:
+        """
+        Branch counters: total, run inline (pool saturated), timed out and failed.
+        The last two are the branches that rendered their fallback.
+        """
+        with ParallelLoader._stats_lock:
+            counters = dict(ParallelLoader._stats)
+
+        counters["fallbacks"] = counters["timeouts"] + counters["errors"]
+
+        return counters
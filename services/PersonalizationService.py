@@ -0,0 +1,195 @@
+from datetime import datetime, timezone
+from itertools import permutations
+from typing import Optional
+from pymongo import UpdateOne
+from services.DatabaseService import users, item_cooccurrence, user_feeds
+
+class PersonalizationService:
+    """
+    Service responsible for precomputed, per-user candidate lists built from
+    item-to-item co-occurrence of bookmarks, good ratings and recently
+    viewed businesses.
+
+    Offline (build_feeds):
+    - Users flagged with `feed_dirty` by DatabaseService writes are processed
+      in batches. Only the difference between a user's current item set and
+      the set processed last time (`feed_items`) is applied to the shared
+      `item_cooccurrence` pair counts, so each run is incremental.
+    - Each processed user gets a compact `user_feeds` document: parallel
+      `candidates`/`weights` arrays of unseen businesses ranked by how often
+      they co-occur with the user's items.
+
+    Online (candidates):
+    - One indexed lookup in `user_feeds`; RecommendationService blends the
+      weights into the geo ranking score.
+    """
+
+    # Only the most relevant items per user contribute pairs (bounds work to n^2)
+    MAX_ITEMS_PER_USER = 30
+
+    # Ratings at or above this count as a positive signal
+    MIN_POSITIVE_RATING = 4
+
+    # Neighbours read per item, and candidates stored per user
+    NEIGHBOURS_PER_ITEM = 20
+    FEED_SIZE = 50
+
+    @staticmethod
+    def user_items(user: dict) -> list:
+        """
+        Collect a user's positive signal, most recent first, without duplicates.
+        """
+        rated = user.get("rated") or {}
+        liked = [uuid for uuid, rating in rated.items() if rating >= PersonalizationService.MIN_POSITIVE_RATING]
+
+        items = list(dict.fromkeys((user.get("recently_viewed") or []) + (user.get("bookmarks") or []) + liked))
+
+        return items[:PersonalizationService.MAX_ITEMS_PER_USER]
+
+    @staticmethod
+    def candidates(user_uuid: str) -> Optional[tuple]:
+        """
+        Return the precomputed (candidate_uuids, weights) for a user, or None.
+        Weights are in (0, 1].
+        """
+        feed = user_feeds.find_one({"user_uuid": user_uuid}, {"candidates": 1, "weights": 1, "_id": 0})
+
+        if not feed or not feed.get("candidates"):
+            return None
+
+        return feed["candidates"], feed["weights"]
+
+    @staticmethod
+    def mark_all_dirty():
+        """
+        Flag every user for the next build (initial backfill).
+        """
+        return users.update_many({}, {"$set": {"feed_dirty": datetime.now(timezone.utc)}}).modified_count
+
+    @staticmethod
+    def rebuild():
+        """
+        Reset all pair counts and flag every user, so the next build_feeds
+        recomputes everything from scratch.
+        """
+        item_cooccurrence.delete_many({})
+        users.update_many({}, {"$unset": {"feed_items": ""}, "$set": {"feed_dirty": datetime.now(timezone.utc)}})
+
+    @staticmethod
+    def build_feeds(batch_size: int = 500, max_batches: Optional[int] = None) -> dict:
+        """
+        Process dirty users in batches until none are left (or max_batches).
+
+        Can be stopped and resumed: a user is only un-flagged after their
+        pair counts, feed and `feed_items` have been written, and only if
+        they were not flagged again meanwhile. A crash mid-batch can apply a
+        user's pair delta twice; counts are a ranking signal, and rebuild()
+        resets them if needed.
+
+        Returns:
+        - dict with processed user and pair update counts
+        """
+        stats = {"users": 0, "pair_updates": 0}
+        batches = 0
+
+        while max_batches is None or batches < max_batches:
+            batch = list(users.find(
+                {"feed_dirty": {"$exists": True}},
+                {"uuid": 1, "bookmarks": 1, "rated": 1, "recently_viewed": 1, "feed_items": 1, "feed_dirty": 1}
+            ).limit(batch_size))
+
+            if not batch:
+                break
+
+            pair_updates = PersonalizationService._apply_pair_deltas(batch)
+
+            feed_updates = []
+            user_updates = []
+
+            for user in batch:
+                items = PersonalizationService.user_items(user)
+                candidates, weights = PersonalizationService._rank_candidates(items)
+
+                feed_updates.append(UpdateOne(
+                    {"user_uuid": user["uuid"]},
+                    {"$set": {"candidates": candidates, "weights": weights, "updated_at": datetime.now(timezone.utc)}},
+                    upsert=True
+                ))
+
+                # feed_items always records what the pair counts now reflect;
+                # un-flag only if no new activity arrived while we were working
+                user_updates.append(UpdateOne({"_id": user["_id"]}, {"$set": {"feed_items": items}}))
+                user_updates.append(UpdateOne({"_id": user["_id"], "feed_dirty": user["feed_dirty"]}, {"$unset": {"feed_dirty": ""}}))
+
+            user_feeds.bulk_write(feed_updates, ordered=False)
+            users.bulk_write(user_updates, ordered=False)
+
+            stats["users"] += len(batch)
+            stats["pair_updates"] += pair_updates
+            batches += 1
+
+        return stats
+
+    @staticmethod
+    def _apply_pair_deltas(batch: list) -> int:
+        """
+        Apply the change in each user's item set to the pair counts.
+        Pairs are stored in both directions so neighbours are looked up by `a`.
+        """
+        deltas = {}
+
+        for user in batch:
+            old_items = set(user.get("feed_items") or [])
+            new_items = set(PersonalizationService.user_items(user))
+
+            if old_items == new_items:
+                continue
+
+            for pair in permutations(new_items, 2):
+                deltas[pair] = deltas.get(pair, 0) + 1
+
+            for pair in permutations(old_items, 2):
+                deltas[pair] = deltas.get(pair, 0) - 1
+
+        updates = [
+            UpdateOne({"a": a, "b": b}, {"$inc": {"count": delta}}, upsert=True)
+            for (a, b), delta in deltas.items()
+            if delta != 0
+        ]
+
+        if updates:
+            item_cooccurrence.bulk_write(updates, ordered=False)
+
+        return len(updates)
+
+    @staticmethod
+    def _rank_candidates(items: list) -> tuple:
+        """
+        Score unseen businesses by summed co-occurrence with the user's items.
+
+        Returns:
+        - (candidate_uuids, weights) normalized so the best candidate has weight 1
+        """
+        if not items:
+            return [], []
+
+        seen = set(items)
+        scores = {}
+
+        neighbours = item_cooccurrence.find(
+            {"a": {"$in": items}, "count": {"$gt": 0}},
+            {"a": 1, "b": 1, "count": 1, "_id": 0}
+        ).sort("count", -1).limit(len(items) * PersonalizationService.NEIGHBOURS_PER_ITEM)
+
+        for pair in neighbours:
+            if pair["b"] not in seen:
+                scores[pair["b"]] = scores.get(pair["b"], 0) + pair["count"]
+
+        ranked = sorted(scores.items(), key=lambda x: x[1], reverse=True)[:PersonalizationService.FEED_SIZE]
+
+        if not ranked:
+            return [], []
+
+        best = ranked[0][1]
+
+        return [uuid for uuid, _ in ranked], [round(score / best, 4) for _, score in ranked]
@@ -0,0 +1,148 @@
+import threading
+import time
+from collections import OrderedDict
+from pymongo import ReturnDocument
+
+class MemoryBucketStore:
+    """
+    Token buckets kept in this process (bounded; least recently used keys
+    are dropped, which simply gives them a full bucket again).
+    """
+
+    def __init__(self, maxsize: int = 100000):
+        self.maxsize = maxsize
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _refilled(self, key: str, capacity: float, refill_per_second: float, now: float) -> float:
+        tokens, updated = self._buckets.get(key, (capacity, now))
+        return min(capacity, tokens + (now - updated) * refill_per_second)
+
+    def _save(self, key: str, tokens: float, now: float):
+        self._buckets[key] = (tokens, now)
+        self._buckets.move_to_end(key)
+
+        while len(self._buckets) > self.maxsize:
+            self._buckets.popitem(last=False)
+
+    def take(self, key: str, capacity: float, refill_per_second: float) -> bool:
+        now = time.monotonic()
+
+        with self._lock:
+            tokens = self._refilled(key, capacity, refill_per_second, now)
+
+            allowed = tokens >= 1
+            if allowed:
+                tokens -= 1
+
+            self._save(key, tokens, now)
+
+        return allowed
+
+    def reserve(self, key: str, capacity: float, refill_per_second: float, max_wait: float):
+        """
+        Take a token now or in the future: the balance may go negative, and
+        each reservation waits for the tokens owed before it. Returns the
+        seconds to wait, or None (nothing taken) if that exceeds max_wait.
+        """
+        now = time.monotonic()
+
+        with self._lock:
+            tokens = self._refilled(key, capacity, refill_per_second, now)
+            wait = max(0.0, (1 - tokens) / refill_per_second)
+
+            if wait > max_wait:
+                self._save(key, tokens, now)
+                return None
+
+            self._save(key, tokens - 1, now)
+
+        return wait
+
+class MongoBucketStore:
+    """
+    Token buckets shared by every app process, one document per key.
+    Refill, check and take happen in a single atomic update (server clock).
+    The collection should have a TTL index on `updated` to drop idle buckets.
+    """
+
+    def __init__(self, collection):
+        self.collection = collection
+
+    def take(self, key: str, capacity: float, refill_per_second: float) -> bool:
+        elapsed = {"$divide": [{"$subtract": ["$$NOW", {"$ifNull": ["$updated", "$$NOW"]}]}, 1000]}
+        refilled = {"$min": [capacity, {"$add": [{"$ifNull": ["$tokens", capacity]}, {"$multiply": [elapsed, refill_per_second]}]}]}
+
+        bucket = self.collection.find_one_and_update(
+            {"_id": key},
+            [
+                {"$set": {"tokens": refilled, "updated": "$$NOW"}},
+                {"$set": {
+                    "allowed": {"$gte": ["$tokens", 1]},
+                    "tokens": {"$cond": [{"$gte": ["$tokens", 1]}, {"$subtract": ["$tokens", 1]}, "$tokens"]}
+                }}
+            ],
+            projection={"allowed": 1, "_id": 0},
+            upsert=True,
+            return_document=ReturnDocument.AFTER
+        )
+
+        return bucket["allowed"]
+
+    def reserve(self, key: str, capacity: float, refill_per_second: float, max_wait: float):
+        """
+        Shared equivalent of MemoryBucketStore.reserve, in one atomic update:
+        the balance may go negative, and the returned wait covers the tokens
+        already owed by every process. None (nothing taken) if it exceeds max_wait.
+        """
+        elapsed = {"$divide": [{"$subtract": ["$$NOW", {"$ifNull": ["$updated", "$$NOW"]}]}, 1000]}
+        refilled = {"$min": [capacity, {"$add": [{"$ifNull": ["$tokens", capacity]}, {"$multiply": [elapsed, refill_per_second]}]}]}
+
+        bucket = self.collection.find_one_and_update(
+            {"_id": key},
+            [
+                {"$set": {"tokens": refilled, "updated": "$$NOW"}},
+                {"$set": {"wait": {"$max": [0, {"$divide": [{"$subtract": [1, "$tokens"]}, refill_per_second]}]}}},
+                {"$set": {"reserved": {"$lte": ["$wait", max_wait]}}},
+                {"$set": {"tokens": {"$cond": ["$reserved", {"$subtract": ["$tokens", 1]}, "$tokens"]}}}
+            ],
+            projection={"wait": 1, "reserved": 1, "_id": 0},
+            upsert=True,
+            return_document=ReturnDocument.AFTER
+        )
+
+        return bucket["wait"] if bucket["reserved"] else None
+
+class TokenBucket:
+    """
+    Token bucket rate limiter: each key gets `capacity` tokens that refill
+    continuously at one token per `refill_seconds`; every allowed action
+    takes one. Checks are O(1) regardless of how much history a key has.
+
+    Buckets live in this process by default; pass a MongoBucketStore to
+    share them across processes.
+    """
+
+    def __init__(self, capacity: float, refill_seconds: float, store=None):
+        """
+        Parameters:
+        - capacity (float): Burst size (tokens in a full bucket).
+        - refill_seconds (float): Seconds to regain one token.
+        - store: MemoryBucketStore (default) or MongoBucketStore.
+        """
+        self.capacity = capacity
+        self.refill_per_second = 1 / refill_seconds
+        self.store = store or MemoryBucketStore()
+
+    def allow(self, key: str) -> bool:
+        """
+        Take a token for key. Returns False if the bucket is empty.
+        """
+        return self.store.take(key, self.capacity, self.refill_per_second)
+
+    def reserve(self, key: str, max_wait: float):
+        """
+        Queue for a token for key: returns the seconds to sleep before
+        acting, or None when the queue ahead is longer than max_wait seconds.
+        """
+        return self.store.reserve(key, self.capacity, self.refill_per_second, max_wait)
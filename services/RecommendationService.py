@@ -1,6 +1,20 @@
+import base64
+import copy
+import json
 import math
-from typing import Optional, List
-from services.DatabaseService import business_profiles, sponsored_businesses
+import re
+from typing import Optional, List, Sequence
+from services.DatabaseService import business_profiles, business_change_listeners, BusinessCard, CARD_PROJECTION, RATING_WEIGHT
+from services.SponsoredIndex import sponsored_index
+from services.SearchService import SearchService
+from services.PersonalizationService import PersonalizationService
+from services.CacheService import TTLCache, geohash, geohash_center, cell_may_contain, haversine_km
+
+# Optional: vectorized re-ranking (score_batch falls back to pure Python)
+try:
+    import numpy as np
+except ImportError:
+    np = None
 
 class RecommendationService:
     """
@@ -8,8 +22,63 @@ class RecommendationService:
     based on user location, filters, and ranking logic.
 
     Uses MongoDB geospatial queries combined with custom scoring logic.
+    Rating, score and the minimum rating filter are computed inside the
+    aggregation so the whole candidate set is ranked before pagination.
     """
 
+    # Score weights (see _score); the rating weight is shared with the
+    # stored popularity field maintained by DatabaseService
+    RATING_WEIGHT = RATING_WEIGHT
+    DISTANCE_PENALTY_PER_KM = 0.2
+
+    # Weight of text relevance (0..2) when a search query is given
+    TEXT_RELEVANCE_WEIGHT = 2
+
+    # Maximum score boost for a business in the user's personalized candidates
+    PERSONAL_WEIGHT = 1.5
+
+    # Card fields plus the inputs needed for ranking
+    _RANKING_PROJECTION = {**CARD_PROJECTION, "avg_rating": 1, "popularity": 1, "distance_m": 1, "relevance": 1, "location": 1}
+
+    # Final shape of each result (rounded for display)
+    _RESULT_PROJECTION = {
+        **{field: 1 for field in CARD_PROJECTION if field != "_id"},
+        "_id": 0,
+        "distance_m": 1,
+        "score": 1,
+        "rating": {"$round": ["$rating", 1]},
+        "distance_km": {"$round": ["$distance_km", 2]},
+        # Per-visitor re-ranking inputs (see _rerank)
+        "lat": {"$arrayElemAt": ["$location.coordinates", 1]},
+        "lng": {"$arrayElemAt": ["$location.coordinates", 0]},
+        "popularity": {"$ifNull": ["$popularity", 0]},
+        "relevance": {"$ifNull": ["$relevance", 0]},
+        "personal": 1,
+    }
+
+    # Fallback location for visitors who have not set one (Cornell, Markham)
+    DEFAULT_LAT = 43.892958
+    DEFAULT_LNG = -79.228599
+
+    # Result pages are cached per ~150m geohash cell; queries run from the
+    # cell center so every visitor in the cell gets the same businesses.
+    # Each visitor then gets them re-ranked and with distances measured
+    # from their own position (score_batch); cursors keep the cell ranking.
+    RESULT_CELL_PRECISION = 7
+    RESULT_TTL_SECONDS = 300
+
+    _result_cache = TTLCache(maxsize=2048, ttl=RESULT_TTL_SECONDS)
+
+    # Total counts only drive pagination, so they are shared by everyone
+    # in the same ~5km geohash cell with the same filters for a short time.
+    COUNT_CELL_PRECISION = 5
+    COUNT_TTL_SECONDS = 120
+
+    # Estimated mode stops counting past this many results ("100+ results")
+    COUNT_CEILING = 100
+
+    _count_cache = TTLCache(maxsize=4096, ttl=COUNT_TTL_SECONDS)
+
     @staticmethod
     def recommend(
         user_lat: float,
@@ -19,133 +88,442 @@ class RecommendationService:
         categories=None,
         user_query=None,
         limit: int = 20,
-        offset: int = 0
+        offset: int = 0,
+        estimate_count: bool = False,
+        cursor: Optional[str] = None,
+        user_uuid: Optional[str] = None
     ):
+        """
+        Return one page of ranked business cards and the total result count.
+
+        Whole pages are cached per geohash cell + filters (LRU + TTL) and
+        invalidated when a nearby business changes.
+        The total comes from a TTL cache keyed by a coarser location cell and
+        the filters; only a cache miss pays for the $count branch.
+        With estimate_count=True, counting stops at COUNT_CEILING + 1, so any
+        total above COUNT_CEILING should be displayed as "COUNT_CEILING+".
+
+        With a user_uuid, the user's precomputed personalized candidates
+        (one indexed lookup) boost matching businesses in the score; such
+        pages are cached per user.
+
+        When a cursor (from next_cursor) is given, the page starts right after
+        the last result it encodes and offset is ignored, so every page costs
+        the same and sequential pages never overlap or skip results.
+
+        Returns:
+        - (list[BusinessCard], int)
+        """
+
+        cell = geohash(user_lat, user_lng, RecommendationService.RESULT_CELL_PRECISION)
+        after = RecommendationService._decode_cursor(cursor)
+
+        if after:
+            offset = 0
+
+        result_key = (cell, max_distance_km, min_rating or 0, tuple(sorted(categories or [])), (user_query or "").strip().lower(), limit, offset, estimate_count, after, user_uuid)
+
+        cached = RecommendationService._result_cache.get(result_key)
+
+        if cached is not None:
+            results, total, columns = cached
+            return RecommendationService._rerank(user_lat, user_lng, results, columns), total
+
+        visitor_lat, visitor_lng = user_lat, user_lng
+        user_lat, user_lng = geohash_center(cell)
+
+        personal = PersonalizationService.candidates(user_uuid) if user_uuid else None
+
+        pipeline = RecommendationService._pipeline(user_lat, user_lng, max_distance_km, min_rating, categories, user_query, personal)
+        page = [{"$skip": offset}, {"$limit": limit}, {"$project": RecommendationService._RESULT_PROJECTION}]
+
+        if after:
+            score, distance_m, business_uuid = after
+
+            # Keyset condition on the (score desc, distance_m asc, uuid asc) sort order
+            keyset = {"$match": {"$or": [
+                {"score": {"$lt": score}},
+                {"score": score, "distance_m": {"$gt": distance_m}},
+                {"score": score, "distance_m": distance_m, "uuid": {"$gt": business_uuid}}
+            ]}}
+
+            page[0] = keyset
+
+        count_key = RecommendationService._count_key(user_lat, user_lng, max_distance_km, min_rating, categories, user_query, estimate_count)
+        total = RecommendationService._count_cache.get(count_key)
+
+        if total is None:
+            count_branch = [{"$count": "count"}]
+
+            if estimate_count:
+                count_branch.insert(0, {"$limit": RecommendationService.COUNT_CEILING + 1})
+
+            pipeline.append({"$facet": {"results": page, "totalCount": count_branch}})
+
+            data = list(business_profiles.aggregate(pipeline))[0]
+
+            rows = data["results"]
+            total = data["totalCount"][0]["count"] if data["totalCount"] else 0
+
+            RecommendationService._count_cache.set(count_key, total)
+        else:
+            if after:
+                # Filter before the sort stage so only the remaining rows get sorted
+                pipeline.insert(len(pipeline) - 1, page.pop(0))
+
+            rows = list(business_profiles.aggregate(pipeline + page))
+
+        results = [BusinessCard.from_doc(b) for b in rows]
+        columns = {field: [b.get(field) or 0 for b in rows] for field in ("lat", "lng", "popularity", "relevance", "personal")}
+
+        RecommendationService._result_cache.set(result_key, (results, total, columns))
+
+        return RecommendationService._rerank(visitor_lat, visitor_lng, results, columns), total
+
+    @staticmethod
+    def _rerank(user_lat: float, user_lng: float, results: List[BusinessCard], columns: dict) -> List[BusinessCard]:
+        """
+        Order a cached page for one visitor: distances and scores from the
+        visitor's own position (same formula as _pipeline), best first.
+
+        Returns copies: `distance_km` is the visitor's distance, while
+        `score`/`distance_m` keep the page's ranking key for next_cursor.
+        """
+        if not results:
+            return results
+
+        distances_km, scores = RecommendationService.score_batch(
+            user_lat, user_lng,
+            columns["lat"], columns["lng"],
+            columns["popularity"], columns["relevance"], columns["personal"]
+        )
+
+        ranked = []
+
+        for card, distance_km, score in zip(results, distances_km, scores):
+            card = copy.copy(card)
+            card.distance_km = round(float(distance_km), 2)
+            ranked.append((-float(score), card.distance_km, card.uuid, card))
+
+        ranked.sort(key=lambda entry: entry[:3])
+
+        return [entry[3] for entry in ranked]
+
+    @staticmethod
+    def invalidate_business(business_uuid: str, coordinates=None):
+        """
+        Drop cached pages and counts for every search area that could include
+        a business whose rating, bookmarks, location or card changed.
+
+        Cache keys start with (cell, max_distance_km), so an entry is stale if
+        the business lies within max_distance_km of any point in its cell.
+        Unknown coordinates clear both caches.
+        """
+        caches = (RecommendationService._result_cache, RecommendationService._count_cache)
+
+        if coordinates is None:
+            for cache in caches:
+                cache.clear()
+            return
+
+        lng, lat = coordinates
+
+        # Many keys share a (cell, radius) prefix; test each prefix once
+        affected = {}
+
+        def is_stale(key):
+            prefix = key[:2]
+
+            if prefix not in affected:
+                affected[prefix] = cell_may_contain(prefix[0], prefix[1], lat, lng)
+
+            return affected[prefix]
 
-        pipeline = [{"$geoNear": {"near": {"type": "Point", "coordinates": [user_lng, user_lat]}, "distanceField": "distance_m", "maxDistance": int(max_distance_km * 1000), "spherical": True}},]
+        for cache in caches:
+            cache.invalidate_where(is_stale)
+
+    @staticmethod
+    def prewarm():
+        """
+        Fill the cache with the first page anonymous visitors see at the
+        default location (with and without a sponsored slot).
+        """
+        for per_page in (12, 11):
+            RecommendationService.recommend(
+                user_lat=RecommendationService.DEFAULT_LAT,
+                user_lng=RecommendationService.DEFAULT_LNG,
+                max_distance_km=10,
+                limit=per_page,
+                offset=0
+            )
+
+    @staticmethod
+    def cache_stats() -> dict:
+        """
+        Hit rate, size and eviction counters for the recommendation caches.
+        """
+        return {
+            "results": RecommendationService._result_cache.stats(),
+            "counts": RecommendationService._count_cache.stats()
+        }
+
+    @staticmethod
+    def next_cursor(results: List[BusinessCard]) -> Optional[str]:
+        """
+        Build the opaque token for the page after `results`.
+        Encodes the (score, distance_m, uuid) sort key of the page's last
+        result in ranking order (pages are shown re-ranked per visitor).
+
+        Returns:
+        - str token, or None if there are no results
+        """
+        if not results:
+            return None
+
+        last = max(results, key=lambda card: (-card.score, card.distance_m, card.uuid))
+        payload = json.dumps([last.score, last.distance_m, last.uuid], separators=(",", ":"))
+
+        return base64.urlsafe_b64encode(payload.encode()).decode().rstrip("=")
+
+    @staticmethod
+    def _decode_cursor(cursor: Optional[str]) -> Optional[tuple]:
+        """
+        Decode a token from next_cursor.
+        Returns None for missing or malformed tokens (callers fall back to offset paging).
+        """
+        if not cursor:
+            return None
+
+        try:
+            padded = cursor + "=" * (-len(cursor) % 4)
+            score, distance_m, business_uuid = json.loads(base64.urlsafe_b64decode(padded.encode()))
+
+            return float(score), float(distance_m), str(business_uuid)
+        except (ValueError, TypeError):
+            return None
+
+    @staticmethod
+    def _count_key(user_lat, user_lng, max_distance_km, min_rating, categories, user_query, estimate_count) -> tuple:
+        """
+        Cache key for total counts: coarse location cell plus normalized filters.
+        """
+        return (
+            geohash(user_lat, user_lng, RecommendationService.COUNT_CELL_PRECISION),
+            max_distance_km,
+            min_rating or 0,
+            tuple(sorted(categories or [])),
+            (user_query or "").strip().lower(),
+            estimate_count
+        )
+
+    @staticmethod
+    def _pipeline(user_lat, user_lng, max_distance_km, min_rating, categories, user_query, personal=None) -> List[dict]:
+        """
+        Build the ranking pipeline (everything before pagination).
+
+        Stages:
+        1. $geoNear candidate search around the user, with category,
+           minimum rating and search token filters served by the
+           geo_rating_search index
+        2. Text relevance (share of query tokens found in the business)
+        3. Card projection (drops comments, coupons, etc.)
+        4. Stored average rating and distance in km
+        5. Score (stored popularity minus distance penalty, plus text
+           relevance and personal boost; same formula as _score) and a
+           stable sort
+
+        personal is an optional (candidate_uuids, weights) pair from
+        PersonalizationService.candidates.
+
+        Returns:
+        - list of aggregation stages
+        """
+
+        geo_filter = {}
 
         # Optional category filter
         if categories:
-            pipeline.append({"$match": {"category": {"$in": categories}}})
+            geo_filter["category"] = {"$in": categories}
+
+        # Skip businesses below minimum rating threshold
+        if min_rating:
+            geo_filter["avg_rating"] = {"$gte": min_rating}
 
-        # Optional text search (case-insensitive regex match)
-        if user_query:
-            pipeline.append({"$match": {"$or": [{"name": {"$regex": user_query, "$options": "i"}}, {"description": {"$regex": user_query, "$options": "i"}}]}})
+        # Optional text search on the stemmed token index
+        query_tokens = SearchService.tokenize(user_query)
 
-        pipeline.append({"$facet": {"results": [{"$skip": offset}, {"$limit": limit}], "totalCount": [{"$count": "count"}]}})
+        if query_tokens:
+            geo_filter["search_tokens"] = {"$in": query_tokens}
+        elif user_query and user_query.strip():
+            # Nothing indexable (e.g. only stopwords); match the literal text in names
+            geo_filter["name"] = {"$regex": re.escape(user_query.strip()), "$options": "i"}
 
-        data = list(business_profiles.aggregate(pipeline))[0]
+        geo_near = {"near": {"type": "Point", "coordinates": [user_lng, user_lat]}, "distanceField": "distance_m", "maxDistance": int(max_distance_km * 1000), "spherical": True, "key": "location"}
 
-        results = data["results"]
-        total = data["totalCount"][0]["count"] if data["totalCount"] else 0
+        if geo_filter:
+            geo_near["query"] = geo_filter
 
-        enriched_results = []
+        pipeline = [{"$geoNear": geo_near}]
 
-        # Post-processing: compute rating, distance, and ranking score
-        for b in results:
+        if query_tokens:
+            # Fraction of query tokens matched anywhere, plus a bonus for name matches (0..2)
+            matched = lambda field: {"$divide": [{"$size": {"$setIntersection": [{"$ifNull": [field, []]}, query_tokens]}}, len(query_tokens)]}
+            pipeline.append({"$addFields": {"relevance": {"$add": [matched("$search_tokens"), matched("$name_tokens")]}}})
 
-            # Compute average rating
-            users_rated = int(b.get("users_rated", 0))
-            combined_rating = float(b.get("combined_rating", 0))
-            rating = (combined_rating / users_rated if users_rated > 0 else 0)
+        # Only carry card fields through the ranking stages (no comments/coupons)
+        pipeline.append({"$project": RecommendationService._RANKING_PROJECTION})
 
-            # Skip businesses below minimum rating threshold
-            if rating < min_rating:
-                continue
+        # Personal boost: weight of this business in the user's candidate list (0 if absent)
+        personal_boost = {"$literal": 0}
 
-            distance_km = RecommendationService._distance_km(user_lat, user_lng, b["location"]["coordinates"][1], b["location"]["coordinates"][0])
+        if personal:
+            candidate_uuids, weights = personal
+            personal_boost = {"$let": {
+                "vars": {"i": {"$indexOfArray": [candidate_uuids, "$uuid"]}},
+                "in": {"$cond": [{"$gte": ["$$i", 0]}, {"$multiply": [{"$arrayElemAt": [weights, "$$i"]}, RecommendationService.PERSONAL_WEIGHT]}, 0]}
+            }}
 
-            # Enrich business object with computed values
-            b["rating"] = round(rating, 1)
-            b["distance_km"] = round(distance_km, 2)
-            b["score"] = RecommendationService._score(b, rating, distance_km)
+        # Stored average rating (kept up to date on write), distance in km and personal boost
+        pipeline.append({"$addFields": {
+            "rating": {"$ifNull": ["$avg_rating", 0]},
+            "distance_km": {"$divide": ["$distance_m", 1000]},
+            "personal": personal_boost
+        }})
 
-            enriched_results.append(b)
+        # popularity = (rating * 2) + log(bookmarks + 1), stored on write
+        # score = popularity - (distance_km * 0.2) + (relevance * 2) + personal (same as _score)
+        pipeline.append({"$addFields": {"score": {"$subtract": [
+            {"$add": [
+                {"$ifNull": ["$popularity", 0]},
+                {"$multiply": [{"$ifNull": ["$relevance", 0]}, RecommendationService.TEXT_RELEVANCE_WEIGHT]},
+                "$personal"
+            ]},
+            {"$multiply": ["$distance_km", RecommendationService.DISTANCE_PENALTY_PER_KM]}
+        ]}}})
 
-        enriched_results.sort(key=lambda x: x["score"], reverse=True)
+        # Ties broken by distance, then uuid, so pages never overlap
+        pipeline.append({"$sort": {"score": -1, "distance_m": 1, "uuid": 1}})
 
-        return enriched_results, total
+        return pipeline
 
     @staticmethod
-    def _score(business: dict, rating: float, distance_km: float) -> float:
+    def _score(popularity: float, distance_km: float, relevance: float = 0, personal: float = 0) -> float:
         """
         Compute recommendation score for a business.
 
         Scoring formula:
-            (rating * 2) + log(bookmarks + 1) - (distance_km * 0.2)
+            popularity - (distance_km * 0.2) + (relevance * 2) + personal
+
+        where popularity = (rating * 2) + log(bookmarks + 1) is stored on
+        each business, relevance (0..2) is the text match of a search and
+        personal is the boost from the user's candidate list.
 
-        Factors:
-        - Rating is heavily weighted.
-        - Bookmarks increase popularity influence (logarithmic scaling).
-        - Distance reduces score (closer businesses rank higher).
+        The aggregation in _pipeline computes the same formula; keep them in sync.
 
         Returns:
         - float score value
         """
-        bookmarks = int(business.get("bookmarks", 0))
-        return (rating * 2) + math.log(bookmarks + 1) - (distance_km * 0.2)
+        return (
+            popularity
+            - (distance_km * RecommendationService.DISTANCE_PENALTY_PER_KM)
+            + (relevance * RecommendationService.TEXT_RELEVANCE_WEIGHT)
+            + personal
+        )
 
     @staticmethod
-    def _distance_km(lat1, lng1, lat2, lng2):
+    def score_batch(
+        user_lat: float,
+        user_lng: float,
+        lats: Sequence[float],
+        lngs: Sequence[float],
+        popularity: Sequence[float],
+        relevance: Optional[Sequence[float]] = None,
+        personal: Optional[Sequence[float]] = None,
+        vectorized: Optional[bool] = None
+    ):
         """
-        Calculate the distance between two geographic coordinates
-        using the Haversine formula.
+        Compute distances and scores (_score) for many businesses at once.
 
-        Parameters:
-        - lat1, lng1: User coordinates
-        - lat2, lng2: Business coordinates
+        Inputs are parallel columns (one entry per business); relevance and
+        personal default to 0. Uses NumPy when available; vectorized=False
+        forces the pure-Python path (vectorized=True requires NumPy).
 
         Returns:
-        - Distance in kilometers (float)
+        - (distances_km, scores) as NumPy arrays or Python lists
         """
+        if vectorized is None:
+            vectorized = np is not None
+
+        if vectorized:
+            if np is None:
+                raise RuntimeError("NumPy is required for vectorized scoring")
 
-        # Earth's radius in kilometers
-        R = 6371
+            return RecommendationService._score_batch_numpy(user_lat, user_lng, lats, lngs, popularity, relevance, personal)
 
-        # Convert differences to radians
-        dlat = math.radians(lat2 - lat1)
-        dlng = math.radians(lng2 - lng1)
+        return RecommendationService._score_batch_python(user_lat, user_lng, lats, lngs, popularity, relevance, personal)
 
-        # Haversine formula
-        a = (
-            math.sin(dlat / 2) ** 2 +
-            math.cos(math.radians(lat1)) *
-            math.cos(math.radians(lat2)) *
-            math.sin(dlng / 2) ** 2
+    @staticmethod
+    def _score_batch_numpy(user_lat, user_lng, lats, lngs, popularity, relevance, personal):
+        """
+        Vectorized implementation of score_batch.
+        """
+        popularity = np.asarray(popularity, dtype=np.float64)
+        relevance = np.zeros_like(popularity) if relevance is None else np.asarray(relevance, dtype=np.float64)
+        personal = np.zeros_like(popularity) if personal is None else np.asarray(personal, dtype=np.float64)
+
+        lat1 = math.radians(user_lat)
+        lat2 = np.radians(np.asarray(lats, dtype=np.float64))
+        dlat = lat2 - lat1
+        dlng = np.radians(np.asarray(lngs, dtype=np.float64) - user_lng)
+
+        a = np.sin(dlat / 2) ** 2 + math.cos(lat1) * np.cos(lat2) * np.sin(dlng / 2) ** 2
+        distances_km = 6371 * 2 * np.arctan2(np.sqrt(a), np.sqrt(1 - a))
+
+        scores = (
+            popularity
+            - (distances_km * RecommendationService.DISTANCE_PENALTY_PER_KM)
+            + (relevance * RecommendationService.TEXT_RELEVANCE_WEIGHT)
+            + personal
         )
 
-        # Great-circle distance
-        return R * 2 * math.atan2(math.sqrt(a), math.sqrt(1 - a))
-    
+        return distances_km, scores
+
+    @staticmethod
+    def _score_batch_python(user_lat, user_lng, lats, lngs, popularity, relevance, personal):
+        """
+        Pure-Python fallback for score_batch (same results as the NumPy path).
+        """
+        distances_km = []
+        scores = []
+
+        for i in range(len(popularity)):
+            distance_km = haversine_km(user_lat, user_lng, lats[i], lngs[i])
+
+            distances_km.append(distance_km)
+            scores.append(RecommendationService._score(
+                popularity[i],
+                distance_km,
+                relevance[i] if relevance is not None else 0,
+                personal[i] if personal is not None else 0
+            ))
+
+        return distances_km, scores
+
     @staticmethod
     def recommend_sponsored_business(
         user_lat: float,
         user_lng: float,
-        max_distance_km: float = 20
-    ) -> Optional[dict]:
+        max_distance_km: float = 20,
+        weighted: bool = True
+    ) -> Optional[BusinessCard]:
         """
-        Returns a random sponsored business within the given distance (default 20km).
+        Returns a random sponsored business card within the given distance (default 20km).
 
         Steps:
-        1. Find sponsored businesses within max_distance_km
-        2. Randomly pick one
+        1. Find sponsored businesses within max_distance_km (in-process grid index)
+        2. Pick one, proportionally to sponsor weight when weighted=True
         3. Return None if no sponsored businesses found
         """
+        return sponsored_index.choose(user_lat, user_lng, max_distance_km, weighted=weighted)
 
-        pipeline = [
-            {
-                "$geoNear": {
-                    "near": {
-                        "type": "Point",
-                        "coordinates": [user_lng, user_lat]
-                    },
-                    "distanceField": "distance_m",
-                    "maxDistance": int(max_distance_km * 1000),
-                    "spherical": True
-                }
-            },
-            {"$sample": {"size": 1}}
-        ]
-
-        result = list(sponsored_businesses.aggregate(pipeline))
-        return result[0] if result else None
+business_change_listeners.append(RecommendationService.invalidate_business)
@@ -0,0 +1,112 @@
+import re
+import unicodedata
+
+class SearchService:
+    """
+    Service responsible for turning business text and user queries into
+    normalized search tokens.
+
+    Businesses store their tokens in `search_tokens` (name + description)
+    and `name_tokens` (name only). Both fields are covered by the geo
+    search index, so a query becomes an indexed $in lookup inside $geoNear
+    instead of a regex scan.
+    """
+
+    # Upper bound on stored tokens per business (long descriptions)
+    MAX_TOKENS = 200
+
+    # Common words that would match almost every business
+    STOPWORDS = {
+        "a", "an", "and", "are", "as", "at", "be", "by", "for", "from", "in",
+        "is", "it", "of", "on", "or", "our", "the", "to", "we", "with", "you", "your"
+    }
+
+    @staticmethod
+    def stem(word: str) -> str:
+        """
+        Reduce a lowercase word to a crude stem so that simple variations
+        ("bakery"/"bakeries", "shop"/"shops"/"shopping") share a token.
+
+        The same function is applied when indexing and when querying, so the
+        stems only need to be consistent, not linguistically correct.
+        """
+        if len(word) <= 3 or word.isdigit():
+            return word
+
+        # Plurals
+        if word.endswith("ies") and len(word) > 4:
+            word = word[:-3] + "y"
+        elif word.endswith("sses"):
+            word = word[:-2]
+        elif re.search(r"(s|x|z|ch|sh)es$", word):
+            word = word[:-2]
+        elif word.endswith("s") and not word.endswith("ss"):
+            word = word[:-1]
+
+        # Verb endings, undoubling the final consonant ("shopping" -> "shop")
+        for suffix in ("ing", "ed"):
+            if word.endswith(suffix) and len(word) - len(suffix) >= 3:
+                word = word[:-len(suffix)]
+
+                if len(word) > 3 and word[-1] == word[-2] and word[-1] not in "aeiouls":
+                    word = word[:-1]
+                break
+
+        # Silent trailing "e" ("bake"/"baking", "cafe"/"cafes")
+        if len(word) > 3 and word.endswith("e"):
+            word = word[:-1]
+
+        return word
+
+    @staticmethod
+    def tokenize(text: str) -> list:
+        """
+        Split text into unique stemmed tokens (in order of first appearance).
+
+        Steps:
+        - Strip accents and lowercase
+        - Keep alphanumeric runs only
+        - Drop single characters and stopwords
+        - Stem
+
+        Parameters:
+        - text (str): Raw business text or user query.
+
+        Returns:
+        - list[str]: Unique tokens.
+        """
+        if not text:
+            return []
+
+        normalized = unicodedata.normalize("NFKD", text).encode("ascii", "ignore").decode().lower()
+
+        tokens = []
+        seen = set()
+
+        for word in re.findall(r"[a-z0-9]+", normalized):
+            if len(word) < 2 or word in SearchService.STOPWORDS:
+                continue
+
+            token = SearchService.stem(word)
+
+            if token not in seen:
+                seen.add(token)
+                tokens.append(token)
+
+        return tokens
+
+    @staticmethod
+    def index_fields(name: str, description: str) -> dict:
+        """
+        Build the stored search fields for a business.
+
+        Returns:
+        - dict with `search_tokens` and `name_tokens`
+        """
+        name_tokens = SearchService.tokenize(name)
+        search_tokens = list(dict.fromkeys(name_tokens + SearchService.tokenize(description)))
+
+        return {
+            "name_tokens": name_tokens,
+            "search_tokens": search_tokens[:SearchService.MAX_TOKENS]
+        }
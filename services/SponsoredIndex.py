@@ -0,0 +1,148 @@
+import math
+import random
+import threading
+import time
+from typing import Optional, List
+from services.DatabaseService import business_profiles, sponsored_businesses, business_change_listeners, BusinessCard, CARD_PROJECTION
+from services.CacheService import haversine_km
+
+class SponsoredIndex:
+    """
+    In-process grid index of sponsored businesses.
+
+    The sponsored set is small and changes rarely, so it is loaded once
+    (together with each business card) and refreshed periodically or when
+    a sponsored business changes. Radius queries and selection then run
+    locally instead of costing a $geoNear + a business lookup per page view.
+
+    Sponsored documents may carry an optional numeric `weight` (default 1)
+    used for weighted rotation.
+    """
+
+    # Reload the sponsored set at most this often (seconds)
+    REFRESH_SECONDS = 300
+
+    # Grid cell size in degrees (~28km of latitude)
+    CELL_DEGREES = 0.25
+
+    def __init__(self):
+        self._grid = {}
+        self._uuids = set()
+        self._loaded_at = None
+        self._stale = True
+        self._lock = threading.Lock()
+
+    def _cell(self, lat: float, lng: float) -> tuple:
+        return (math.floor(lat / self.CELL_DEGREES), math.floor(lng / self.CELL_DEGREES))
+
+    def refresh(self):
+        """
+        Reload sponsored locations and their business cards (two queries),
+        then swap in a new grid.
+        """
+        sponsors = list(sponsored_businesses.find({}, {"uuid": 1, "location": 1, "weight": 1, "_id": 0}))
+        uuids = [s["uuid"] for s in sponsors]
+
+        cards = {
+            b["uuid"]: BusinessCard.from_doc(b)
+            for b in business_profiles.find({"uuid": {"$in": uuids}}, CARD_PROJECTION)
+        }
+
+        grid = {}
+
+        for sponsor in sponsors:
+            card = cards.get(sponsor["uuid"])
+
+            # Skip sponsorships whose business no longer exists
+            if not card:
+                continue
+
+            lng, lat = sponsor["location"]["coordinates"]
+            weight = max(float(sponsor.get("weight", 1)), 0)
+
+            grid.setdefault(self._cell(lat, lng), []).append((lat, lng, weight, card))
+
+        self._grid = grid
+        self._uuids = set(cards)
+        self._loaded_at = time.monotonic()
+        self._stale = False
+
+    def invalidate(self):
+        """
+        Force a reload on the next query.
+        """
+        self._stale = True
+
+    def _ensure_fresh(self):
+        if not self._stale and time.monotonic() - self._loaded_at < self.REFRESH_SECONDS:
+            return
+
+        with self._lock:
+            # Another thread may have refreshed while we waited
+            if self._stale or time.monotonic() - self._loaded_at >= self.REFRESH_SECONDS:
+                self.refresh()
+
+    def nearby(self, lat: float, lng: float, radius_km: float) -> List[tuple]:
+        """
+        Return (distance_km, weight, card) for sponsored businesses within radius_km.
+        """
+        self._ensure_fresh()
+
+        grid = self._grid
+        dlat = radius_km / 111.32
+        dlng = radius_km / (111.32 * max(math.cos(math.radians(lat)), 0.01))
+
+        # Very large radii: checking every entry is cheaper than walking cells
+        if dlat >= 90 or dlng >= 180:
+            candidates = [entry for entries in grid.values() for entry in entries]
+        else:
+            lat_min, lng_min = self._cell(lat - dlat, lng - dlng)
+            lat_max, lng_max = self._cell(lat + dlat, lng + dlng)
+
+            candidates = [
+                entry
+                for i in range(lat_min, lat_max + 1)
+                for j in range(lng_min, lng_max + 1)
+                for entry in grid.get((i, j), ())
+            ]
+
+        results = []
+
+        for entry_lat, entry_lng, weight, card in candidates:
+            distance = haversine_km(lat, lng, entry_lat, entry_lng)
+
+            if distance <= radius_km:
+                results.append((distance, weight, card))
+
+        return results
+
+    def choose(self, lat: float, lng: float, radius_km: float, weighted: bool = True) -> Optional[BusinessCard]:
+        """
+        Pick one sponsored business within radius_km.
+        With weighted=True, selection is proportional to each sponsor's weight.
+
+        Returns:
+        - BusinessCard, or None if no sponsored business is in range
+        """
+        candidates = self.nearby(lat, lng, radius_km)
+
+        if not candidates:
+            return None
+
+        if weighted:
+            weights = [weight for _, weight, _ in candidates]
+
+            if sum(weights) > 0:
+                return random.choices(candidates, weights=weights)[0][2]
+
+        return random.choice(candidates)[2]
+
+    def on_business_change(self, business_uuid: str, coordinates=None):
+        """
+        Reload when a sponsored business changes (name, image, location, ...).
+        """
+        if business_uuid in self._uuids:
+            self.invalidate()
+
+sponsored_index = SponsoredIndex()
+business_change_listeners.append(sponsored_index.on_business_change)
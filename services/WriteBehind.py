@@ -0,0 +1,99 @@
+import atexit
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+class WriteBehindBuffer:
+    """
+    Coalesces writes in memory and flushes them in bulk from a background thread.
+
+    Values added under the same key are combined with merge(old, new)
+    (old is None for the first value), so a burst of writes to one key
+    becomes a single write at the next flush. flush(items) receives the
+    pending {key: value} dict and is expected to write it in one bulk
+    operation.
+
+    If a flush raises, its items are merged back in front of anything
+    added meanwhile and retried on the next flush. Pending items are also
+    flushed at interpreter exit; a crash loses at most one interval.
+    """
+
+    def __init__(self, flush, merge, interval: float = 1.0, max_pending: int = 1000):
+        """
+        Parameters:
+        - flush (callable): Writes a {key: value} dict.
+        - merge (callable): merge(old_or_None, new) -> combined value.
+        - interval (float): Seconds between background flushes.
+        - max_pending (int): Flush early once this many keys are pending.
+        """
+        self._flush = flush
+        self._merge = merge
+        self.interval = interval
+        self.max_pending = max_pending
+
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread = None
+
+        self.added = 0
+        self.flushed = 0
+
+    def add(self, key, value):
+        """
+        Buffer a write. Starts the flush thread on first use.
+        """
+        with self._lock:
+            self._pending[key] = self._merge(self._pending.get(key), value)
+            self.added += 1
+            full = len(self._pending) >= self.max_pending
+
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="write-behind", daemon=True)
+                self._thread.start()
+                atexit.register(self.flush)
+
+        if full:
+            self._wakeup.set()
+
+    def pending(self, key, default=None):
+        """
+        Return the not-yet-flushed value for key.
+        """
+        with self._lock:
+            return self._pending.get(key, default)
+
+    def flush(self) -> int:
+        """
+        Write everything pending now. Returns the number of flushed keys.
+        """
+        # One flush at a time, so batches are written in order
+        with self._flush_lock:
+            with self._lock:
+                batch, self._pending = self._pending, {}
+
+            if not batch:
+                return 0
+
+            try:
+                self._flush(batch)
+            except Exception:
+                logger.exception("Write-behind flush of %d keys failed, retrying later", len(batch))
+
+                with self._lock:
+                    newer, self._pending = self._pending, batch
+
+                    for key, value in newer.items():
+                        self._pending[key] = self._merge(self._pending.get(key), value)
+                return 0
+
+            self.flushed += len(batch)
+            return len(batch)
+
+    def _run(self):
+        while True:
+            self._wakeup.wait(self.interval)
+            self._wakeup.clear()
+            self.flush()